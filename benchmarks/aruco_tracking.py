@@ -0,0 +1,57 @@
+"""
+Per-frame cost of ArUco marker detection, full-frame vs tracking mode of :class:`rcute_cozmars.aruco.ArucoDetector`,
+on synthetic frames of a marker moving across a noisy background.
+
+    python benchmarks/aruco_tracking.py --resolution 640 480 --frames 300
+"""
+import argparse
+import time
+import sys
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import cv2
+from cv2 import aruco
+from rcute_cozmars.aruco import ArucoDetector
+
+def marker(id, size):
+    d = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+    m = aruco.generateImageMarker(d, id, size) if hasattr(aruco, 'generateImageMarker') else aruco.drawMarker(d, id, size)
+    # with a white quiet zone, like the cube faces
+    return cv2.copyMakeBorder(m, size//4, size//4, size//4, size//4, cv2.BORDER_CONSTANT, value=255)
+
+def frames(w, h, n, size):
+    m = marker(1, size)
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (h, w), np.uint8), (0, 0), 3)
+    for i in range(n):
+        im = background.copy()
+        # back and forth across the frame
+        t = i / n * 4
+        x = int((t % 1 if int(t) % 2 == 0 else 1 - t % 1) * (w - m.shape[1]))
+        y = (h - m.shape[0]) // 2 + int(20 * np.sin(i / 10))
+        im[y: y+m.shape[0], x: x+m.shape[1]] = m
+        yield im
+
+def run(detector, images):
+    found = 0
+    t = time.perf_counter()
+    for im in images:
+        corners, ids = detector.detect(im)
+        found += ids is not None
+    return (time.perf_counter() - t) / len(images) * 1000, found / len(images)
+
+def main(args):
+    images = list(frames(*args.resolution, args.frames, args.marker_size))
+    full_ms, full_rate = run(ArucoDetector(track=False), images)
+    track_ms, track_rate = run(ArucoDetector(track=True), images)
+    print(f'full frame   {full_ms:7.2f} ms/frame, detected in {full_rate:.0%} of frames')
+    print(f'tracking     {track_ms:7.2f} ms/frame, detected in {track_rate:.0%} of frames')
+    print(f'speedup      x{full_ms/track_ms:.1f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolution', type=int, nargs=2, default=(480, 360), help='frame size')
+    parser.add_argument('--marker-size', type=int, default=60, help='marker size in pixels')
+    parser.add_argument('--frames', type=int, default=300, help='number of frames')
+    main(parser.parse_args())
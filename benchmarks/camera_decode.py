@@ -0,0 +1,43 @@
+"""
+Cost of decoding a camera frame in each buffer format, see :meth:`rcute_cozmars.camera.Camera.get_buffer`.
+
+    python benchmarks/camera_decode.py --resolution 640 480
+"""
+import argparse
+import time
+import sys
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+import cv2
+from rcute_cozmars.camera import _decode
+
+def jpeg(w, h):
+    # something like a camera image: smooth gradients plus noise
+    x, y = np.meshgrid(np.linspace(0, 255, w), np.linspace(0, 255, h))
+    im = np.dstack([x, y, (x+y)/2]) + np.random.normal(0, 10, (h, w, 3))
+    return cv2.imencode('.jpg', np.clip(im, 0, 255).astype(np.uint8))[1].tobytes()
+
+def main(args):
+    data = jpeg(*args.resolution)
+    base = None
+    for gray in (False, True):
+        for scale in (1, .5, .25, .3):
+            _decode(data, True, gray, scale)
+            t = time.perf_counter()
+            for _ in range(args.n):
+                im = _decode(data, True, gray, scale)
+            ms = (time.perf_counter() - t) / args.n * 1000
+            base = base or ms
+            print(f'gray={gray!s:<5} scale={scale:<5} {im.shape!s:<16} {ms:7.2f} ms  x{base/ms:.1f}')
+    # what a grayscale consumer did before: full color decode, then convert
+    t = time.perf_counter()
+    for _ in range(args.n):
+        cv2.cvtColor(_decode(data, True), cv2.COLOR_BGR2GRAY)
+    print(f'color decode + cvtColor to gray          {(time.perf_counter() - t) / args.n * 1000:7.2f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolution', type=int, nargs=2, default=(480, 360), help='frame size')
+    parser.add_argument('-n', type=int, default=200, help='number of decodes of each format')
+    main(parser.parse_args())
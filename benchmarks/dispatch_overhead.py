@@ -0,0 +1,74 @@
+"""
+Per-call overhead of util.mode dispatching in Robot, AsyncRobot and AioRobot.
+
+No robot is needed: the robots are wired to a null RPC client whose methods return immediately,
+so the numbers are the cost of the SDK plumbing (thread hand-off, futures, coroutine creation) alone.
+
+    python benchmarks/dispatch_overhead.py -n 20000
+"""
+import argparse
+import asyncio
+import threading
+import time
+import sys
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from rcute_cozmars import Robot, AsyncRobot, AioRobot
+
+class NullRPC:
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            pass
+        return call
+
+def offline(robot_cls):
+    robot = robot_cls('0.0.0.0')
+    robot._rpc = NullRPC()
+    if robot_cls is not AioRobot:
+        robot._lo = asyncio.new_event_loop()
+        robot._event_thread = threading.Thread(target=robot._run_loop, args=(robot._lo,), daemon=True)
+        robot._event_thread.start()
+    return robot
+
+def bench(name, n, fn):
+    t = time.perf_counter()
+    fn(n)
+    t = time.perf_counter() - t
+    print(f'{name:<40} {t/n*1e6:8.2f} us/call')
+
+def legacy(robot, n):
+    # what util.mode used to do for each call
+    for _ in range(n):
+        asyncio.run_coroutine_threadsafe(robot._rpc.speed((0, 0)), robot._lo).result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=20000, help='calls per case')
+    n = parser.parse_args().n
+
+    robot = offline(Robot)
+    bench('Robot: run_coroutine_threadsafe (legacy)', n, lambda n: legacy(robot, n))
+    bench('Robot: stop()', n, lambda n: [robot.stop() for _ in range(n)])
+    bench('Robot: motors.speed = ...', n, lambda n: [setattr(robot.motors, 'speed', 0) for _ in range(n)])
+    bench('Robot: forward(nowait=True)', n, lambda n: [robot.forward(nowait=True) for _ in range(n)] and robot.stop())
+
+    robot = offline(AsyncRobot)
+    bench('AsyncRobot: forward().result()', n, lambda n: [robot.forward().result() for _ in range(n)])
+
+    robot = offline(AioRobot)
+    async def aio(n):
+        robot._lo = asyncio.get_running_loop()
+        robot._event_thread = threading.current_thread()
+        t = time.perf_counter()
+        for _ in range(n):
+            await robot.stop()
+        t1 = time.perf_counter()
+        for _ in range(n):
+            await robot.motors.speed(0)
+        t2 = time.perf_counter()
+        print(f'{"AioRobot: await stop()":<40} {(t1-t)/n*1e6:8.2f} us/call')
+        print(f'{"AioRobot: await motors.speed(...)":<40} {(t2-t1)/n*1e6:8.2f} us/call')
+    asyncio.run(aio(n))
+
+if __name__ == '__main__':
+    main()
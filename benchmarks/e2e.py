@@ -0,0 +1,136 @@
+"""
+End-to-end throughput benchmarks against the mock Cozmars server (rcute_cozmars.mock_server).
+
+The mock server runs in its own thread and event loop, with artificial latency/bandwidth/frame rate.
+
+    python benchmarks/e2e.py --latency .01 --fps 10 --duration 5
+"""
+import argparse
+import asyncio
+import threading
+import time
+import sys
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import numpy as np
+from rcute_cozmars import AioRobot
+from rcute_cozmars.mock_server import MockCozmars
+
+def serve_in_thread(**kw):
+    lo = asyncio.new_event_loop()
+    ready = threading.Event()
+    box = []
+    def run():
+        asyncio.set_event_loop(lo)
+        box.append(MockCozmars(**kw))
+        lo.run_until_complete(box[0].start())
+        ready.set()
+        lo.run_forever()
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return box[0]
+
+def report(name, value, unit):
+    print(f'{name:<36} {value:10.2f} {unit}')
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples)-1, int(q*len(samples)))]
+
+async def rpc_round_trip(robot, n):
+    samples = []
+    for _ in range(n):
+        t = time.perf_counter()
+        await robot.sonar.distance()
+        samples.append(time.perf_counter() - t)
+    report('rpc round trip p50', percentile(samples, .5)*1000, 'ms')
+    report('rpc round trip p99', percentile(samples, .99)*1000, 'ms')
+
+async def pose(robot, n):
+    t = time.perf_counter()
+    for _ in range(n):
+        await robot.lights.color('red')
+        await robot.head.angle(10)
+        await robot.lift.height(.5)
+        await robot.motors.speed((0, 0))
+    report('4-command pose, sequential', (time.perf_counter()-t)/n*1000, 'ms')
+    t = time.perf_counter()
+    for _ in range(n):
+        async with robot.batch():
+            robot.lights.color('red')
+            robot.head.angle(10)
+            robot.lift.height(.5)
+            robot.motors.speed((0, 0))
+    report('4-command pose, batch', (time.perf_counter()-t)/n*1000, 'ms')
+
+async def loop_lag(lags, interval=.005):
+    # how late the event loop wakes up a sleeping task, i.e. how long it's blocked
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - t - interval)
+
+async def camera_fps(robot, duration):
+    lags = []
+    async with robot.camera.get_buffer() as buf:
+        await buf.read()
+        ticker = asyncio.create_task(loop_lag(lags))
+        count, t = 0, time.perf_counter()
+        while time.perf_counter() - t < duration:
+            await buf.read()
+            count += 1
+        ticker.cancel()
+    report(f'camera fps delivered (req. {robot.camera.frame_rate})', count/(time.perf_counter()-t), 'fps')
+    report('event loop lag while streaming, p99', percentile(lags, .99)*1000, 'ms')
+
+async def display_fps(robot, duration):
+    image = np.random.randint(0, 255, (135, 240, 3), np.uint8)
+    # a new random image each time, so that every frame is sent in full
+    robot.screen.diff = False
+    count, t = 0, time.perf_counter()
+    while time.perf_counter() - t < duration:
+        image[:] = np.random.randint(0, 255, image.shape, np.uint8)
+        await robot.screen.display(image)
+        count += 1
+    report('display fps (full frame)', count/(time.perf_counter()-t), 'fps')
+    # a changing progress bar, only the changed region is sent
+    robot.screen.diff = True
+    count, t = 0, time.perf_counter()
+    while time.perf_counter() - t < duration:
+        image[60:75, 10:230] = (0, 0, 0)
+        image[60:75, 10:10+count%220] = (0, 255, 0)
+        await robot.screen.display(image)
+        count += 1
+    report('display fps (diff, progress bar)', count/(time.perf_counter()-t), 'fps')
+
+async def speaker_underruns(robot, mock, duration):
+    before = mock.counters['speaker_underruns'], mock.counters['speaker_blocks']
+    sr = robot.speaker.sample_rate
+    await robot.speaker.play(bytes(int(sr*duration)*2), sample_rate=sr, dtype='int16')
+    report('speaker underruns', mock.counters['speaker_underruns']-before[0], f'of {mock.counters["speaker_blocks"]-before[1]} blocks')
+
+async def main(args):
+    mock = serve_in_thread(latency=args.latency, bandwidth=args.bandwidth)
+    robot = AioRobot(mock.address)
+    robot.camera.frame_rate = args.fps
+    robot.camera.resolution = args.resolution
+    await robot.connect()
+    try:
+        await robot.eyes.stop()
+        await rpc_round_trip(robot, args.n)
+        await pose(robot, args.n // 10 or 1)
+        await camera_fps(robot, args.duration)
+        await display_fps(robot, args.duration)
+        await speaker_underruns(robot, mock, args.duration)
+    finally:
+        await robot.disconnect()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=.01, help='round trip latency of the mock link (seconds)')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/second from mock robot to client')
+    parser.add_argument('--fps', type=float, default=10, help='camera frame rate requested')
+    parser.add_argument('--resolution', type=int, nargs=2, default=(480, 360), help='camera resolution requested')
+    parser.add_argument('--duration', type=float, default=3, help='seconds of each throughput case')
+    parser.add_argument('-n', type=int, default=200, help='number of round trips')
+    asyncio.run(main(parser.parse_args()))
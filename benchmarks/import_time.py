@@ -0,0 +1,52 @@
+"""
+Cold-import benchmark of rcute_cozmars.
+
+Each run imports the package in a fresh interpreter, the best of all runs is compared with ``--max-seconds``.
+The script also fails if any of the heavy dependencies, which should only be loaded on first use, is imported.
+
+    python benchmarks/import_time.py --runs 5 --max-seconds 1.0
+"""
+import argparse
+import json
+import subprocess
+import sys
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+HEAVY = ['librosa', 'pydub', 'cv2', 'PIL', 'zeroconf', 'soundfile', 'rcute_cozmars.cube_animation', 'rcute_cozmars.aruco']
+
+PROBE = '''
+import json, sys, time
+t = time.perf_counter()
+import rcute_cozmars
+t = time.perf_counter() - t
+print(json.dumps({'time': t, 'heavy': [m for m in %r if m in sys.modules]}))
+''' % HEAVY
+
+def run_once(python):
+    out = subprocess.run([python, '-c', PROBE], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='fail if the best cold-import time exceeds this')
+    parser.add_argument('--python', default=sys.executable)
+    args = parser.parse_args()
+
+    results = [run_once(args.python) for _ in range(args.runs)]
+    best = min(r['time'] for r in results)
+    heavy = sorted(set(m for r in results for m in r['heavy']))
+    print(f'import rcute_cozmars: best {best*1000:.1f} ms of {args.runs} runs (limit {args.max_seconds*1000:.0f} ms)')
+    failed = False
+    if heavy:
+        print(f'FAIL: heavy modules imported eagerly: {heavy}')
+        failed = True
+    if best > args.max_seconds:
+        print('FAIL: cold-import time regressed')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
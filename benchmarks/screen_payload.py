@@ -0,0 +1,43 @@
+"""
+Cost of encoding screen images for :meth:`rcute_cozmars.screen.Screen.display`, from a BGR image to the msgpack message sent to the robot,
+with the old list-of-ints payload and the current bytes payload.
+
+    python benchmarks/screen_payload.py
+"""
+import argparse
+import time
+import sys
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import msgpack
+import numpy as np
+from rcute_cozmars.screen import image_to_data
+
+def image_to_list(bgr_image):
+    # the payload before it was bytes
+    bgr_image = bgr_image.astype('uint16')
+    color = (
+    ((bgr_image[:, :, 2] & 0xF8) << 8)
+    | ((bgr_image[:, :, 1] & 0xFC) << 3)
+    | (bgr_image[:, :, 0] >> 3)
+    )
+    return np.dstack(((color >> 8) & 0xFF, color & 0xFF)).flatten().tolist()
+
+def bench(encode, image, n):
+    t = time.perf_counter()
+    for _ in range(n):
+        msg = msgpack.packb([0, 1, 'display', [encode(np.rot90(image)), 0, 0, 134, 239]])
+    return (time.perf_counter() - t) / n, len(msg)
+
+def main(args):
+    # full screen as in Screen.display, and an eye-sized block as in EyeAnimation
+    for name, (h, w) in (('full screen', (135, 240)), ('eye block', (60, 50))):
+        image = np.random.randint(0, 256, (h, w, 3), np.uint8)
+        old, old_size = bench(image_to_list, image, args.n)
+        new, new_size = bench(image_to_data, image, args.n)
+        print(f'{name:<12} list: {1/old:8.0f} frames/s {old_size:6} bytes   bytes: {1/new:8.0f} frames/s {new_size:6} bytes   x{old/new:.1f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=200, help='number of frames of each payload')
+    main(parser.parse_args())
@@ -6,5 +6,6 @@ rcute-cozmars provides basic control over the robot, it can be used with `rcute-
 """
 from .robot import Robot, AsyncRobot, AioRobot
 from .cube import Cube, AsyncCube, AioCube
+from .fleet import Fleet, AioFleet
 from .animation import animations
 from .version import __version__
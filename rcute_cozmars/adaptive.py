@@ -0,0 +1,136 @@
+"""
+Adaptive control of the camera video stream, see :data:`rcute_cozmars.camera.Camera.adaptive`
+
+The controller measures, every :data:`~AdaptiveController.interval` seconds while the camera is streaming:
+
+* arrival rate and jitter (std/mean of inter-arrival time) of the frames, which tell whether the link can sustain the stream
+* ratio of frames dropped by buffers because they are not read in time, which tells whether the consumers keep up
+* load of the decoding threads
+
+and steps frame rate, resolution and JPEG quality down when one of them is a bottleneck, or up when all are healthy for a while.
+"""
+import asyncio
+import time
+from collections import deque
+from .util import logger
+
+class AdaptiveController:
+    """Adjusts the camera video stream within the given bounds
+
+    :param min_frame_rate: default to 1
+    :type min_frame_rate: float
+    :param max_frame_rate: default to 15
+    :type max_frame_rate: float
+    :param resolutions: resolutions to choose from, default to `((160, 120), (320, 240), (480, 360), (640, 480))`
+    :type resolutions: list
+    :param qualities: JPEG qualities to choose from, e.g. `(30, 50, 70, 90)`, default to `None` which leaves the quality alone. Only works if the robot's server supports it
+    :type qualities: list
+    :param interval: seconds between adjustments, default to 2
+    :type interval: float
+    """
+    def __init__(self, min_frame_rate=1, max_frame_rate=15, resolutions=((160, 120), (320, 240), (480, 360), (640, 480)), qualities=None, interval=2):
+        self.min_frame_rate = min_frame_rate
+        self.max_frame_rate = max_frame_rate
+        self.resolutions = sorted(resolutions, key=lambda r: r[0]*r[1])
+        self.qualities = sorted(qualities) if qualities else None
+        self.interval = interval
+        self.max_drop_rate = .2
+        """Buffers dropping more than this ratio of frames are too slow, default to 0.2"""
+        self.max_jitter = .5
+        """Frame inter-arrival jitter above this means the link is congested, default to 0.5"""
+        self.max_decode_load = .8
+        """Decoding threads busier than this ratio of time are overloaded, default to 0.8"""
+        self.patience = 3
+        """Number of healthy intervals before stepping up, default to 3"""
+        self.metrics = {}
+        """Measurements of the last interval"""
+        self.decisions = deque(maxlen=20)
+        """Recent adjustments, with the time, reason and new settings"""
+        self._healthy = 0
+
+    def summary(self):
+        """:return: dict of the last :data:`metrics` and recent :data:`decisions`"""
+        return {'metrics': self.metrics, 'decisions': list(self.decisions)}
+
+    def _measure(self, camera, last, elapsed):
+        mux = camera._multiplex_output_stream
+        arrivals = [t for t in mux.arrivals if t > time.monotonic() - elapsed]
+        gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+        mean = sum(gaps) / len(gaps) if gaps else 0
+        jitter = (sum((g-mean)**2 for g in gaps) / len(gaps))**.5 / mean if mean else 0
+        received, dropped, decode_time = mux.received - last[0], mux.dropped - last[1], mux.decode_time - last[2]
+        return {
+            'frame_rate': (mux._seq - last[3]) / elapsed,
+            'jitter': jitter,
+            'drop_rate': dropped / received if received else 0,
+            'decode_load': decode_time / elapsed / camera.decode_workers,
+        }
+
+    def _decide(self, m, frame_rate, res, quality):
+        # return the reason and new (frame_rate, resolution index, quality index), or None to keep them
+        qmin = 0 if self.qualities else quality
+        if m['frame_rate'] < .8 * frame_rate or m['jitter'] > self.max_jitter:
+            reason = 'link'
+            if quality > qmin:
+                quality -= 1
+            elif res > 0:
+                res -= 1
+            else:
+                frame_rate *= .75
+        elif m['decode_load'] > self.max_decode_load:
+            reason = 'decoding'
+            if res > 0:
+                res -= 1
+            else:
+                frame_rate *= .75
+        elif m['drop_rate'] > self.max_drop_rate:
+            # no use sending frames faster than the buffers read them
+            reason = 'consumers'
+            frame_rate *= max(1 - m['drop_rate'], .5)
+        else:
+            self._healthy += 1
+            if self._healthy < self.patience:
+                return None
+            reason = 'healthy'
+            if frame_rate < self.max_frame_rate:
+                frame_rate = max(frame_rate * 1.25, frame_rate + 1)
+            elif res < len(self.resolutions) - 1:
+                res += 1
+            elif self.qualities and quality < len(self.qualities) - 1:
+                quality += 1
+            else:
+                return None
+        self._healthy = 0
+        return reason, min(max(frame_rate, self.min_frame_rate), self.max_frame_rate), res, quality
+
+    def _index(self, camera):
+        area = camera.resolution[0] * camera.resolution[1]
+        res = min(range(len(self.resolutions)), key=lambda i: abs(self.resolutions[i][0]*self.resolutions[i][1] - area))
+        quality = min(range(len(self.qualities)), key=lambda i: abs(self.qualities[i] - (camera.quality or 75))) if self.qualities else 0
+        return res, quality
+
+    async def _run(self, camera):
+        last = None
+        while True:
+            await asyncio.sleep(self.interval)
+            mux = camera._multiplex_output_stream
+            now = mux.received, mux.dropped, mux.decode_time, mux._seq, time.monotonic()
+            if camera.closed or last is None:
+                last = None if camera.closed else now
+                continue
+            try:
+                self.metrics = m = self._measure(camera, last, now[4] - last[4])
+                res, cur_quality = self._index(camera)
+                d = self._decide(m, camera.frame_rate, res, cur_quality)
+                if d:
+                    reason, frame_rate, res, quality = d
+                    # quality is only sent when it changes, servers that don't support it keep working until it does
+                    resolution, quality = self.resolutions[res], self.qualities[quality] if self.qualities and quality != cur_quality else None
+                    self.decisions.append({'time': time.time(), 'reason': reason, 'frame_rate': frame_rate, 'resolution': resolution, 'quality': camera.quality if quality is None else quality})
+                    await camera.reconfigure(resolution, frame_rate, quality)
+                    # skip the interval with the restart gap of the stream
+                    last = None
+                else:
+                    last = now
+            except Exception as e:
+                logger.exception(e)
@@ -1,5 +1,33 @@
-from . import cube_animation
+import importlib
+from collections.abc import MutableMapping
 
-animations = {}
-for anim in [cube_animation]:
-    animations.update(anim.animations)
\ No newline at end of file
+class _Animations(MutableMapping):
+    # animation modules depend on cv2, they are not imported until the registry is first used
+    def __init__(self, *modules):
+        self._modules = modules
+        self._anims = None
+
+    def _load(self):
+        if self._anims is None:
+            anims = {}
+            for m in self._modules:
+                anims.update(importlib.import_module(m, __package__).animations)
+            self._anims = anims
+        return self._anims
+
+    def __getitem__(self, name):
+        return self._load()[name]
+
+    def __setitem__(self, name, anim):
+        self._load()[name] = anim
+
+    def __delitem__(self, name):
+        del self._load()[name]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+animations = _Animations('.cube_animation')
@@ -3,10 +3,47 @@ from cv2 import aruco
 import numpy as np
 
 class ArucoDetector:
+    """Detects ArUco markers (DICT_4X4_50) in images
 
-    def __init__(self):
-        self.aruco_dict = aruco.Dictionary_get(aruco.DICT_4X4_50)
-        self.parameters = aruco.DetectorParameters_create()
+    Create one detector and reuse it for consecutive frames: in tracking mode, after markers are found,
+    the next frame is first searched in a region around where they are predicted to be, and the full frame only if they're not found there.
+
+    :param track: enable tracking mode, default to `True`
+    :type track: bool
+    :param padding: padding of the region of interest, relative to the size of the markers found, default to 1
+    :type padding: float
+    :param full_every: search the full frame at least every this number of frames to find new markers, default to 10
+    :type full_every: int
+    """
+    def __init__(self, track=True, padding=1, full_every=10):
+        self.track = track
+        self.padding = padding
+        self.full_every = full_every
+        self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+        if hasattr(aruco, 'ArucoDetector'): # OpenCV >= 4.7
+            self.parameters = aruco.DetectorParameters()
+            self._roi_parameters = aruco.DetectorParameters()
+            self._detector = aruco.ArucoDetector(self.aruco_dict, self.parameters)
+            self._roi_detector = aruco.ArucoDetector(self.aruco_dict, self._roi_parameters)
+        else:
+            self.parameters = aruco.DetectorParameters_create()
+            self._roi_parameters = aruco.DetectorParameters_create()
+            self._detector = None
+        self.reset()
+
+    def _detect(self, img, roi=False):
+        p = self._roi_parameters if roi else self.parameters
+        if not self._detector:
+            return aruco.detectMarkers(img, self.aruco_dict, parameters=p)
+        if roi:
+            self._roi_detector.setDetectorParameters(p)
+        return (self._roi_detector if roi else self._detector).detectMarkers(img)
+
+    def reset(self):
+        """Forget tracked markers"""
+        self._boxes = []
+        self._perimeter = 0
+        self._since_full = 0
 
     def angle_between(self, v1, v2):
         return np.arccos(np.clip(np.dot(v1, v2)/np.linalg.norm(v1)/np.linalg.norm(v2), -1, 1))
@@ -29,9 +66,50 @@ class ArucoDetector:
         tr, br = rightMost[np.argsort(rightMost[:, 1]), :]
         return tr, br, bl, tl
 
-    def detect(self, img):
-        # mean_c =  cv2.adaptiveThreshold(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY),255,cv2.ADAPTIVE_THRESH_MEAN_C,cv2.THRESH_BINARY,65,2)
-        return aruco.detectMarkers(img, self.aruco_dict, parameters=self.parameters)[:2]
+    def _roi(self, shape):
+        # bounding box of tracked markers, moved by their last motion, and padded
+        (x0, y0, x1, y1), (px0, py0, px1, py1) = self._boxes[-1], self._boxes[0]
+        dx, dy = (x0+x1-px0-px1)/2, (y0+y1-py0-py1)/2
+        pad = max(x1-x0, y1-y0) * self.padding + 8
+        h, w = shape[:2]
+        return max(int(x0+dx-pad), 0), max(int(y0+dy-pad), 0), min(int(x1+dx+pad), w), min(int(y1+dy+pad), h)
+
+    def detect(self, img, id_filter=None):
+        """Detect markers
+
+        :param img: BGR or grayscale image
+        :type img: numpy.ndarray
+        :param id_filter: function to select marker ids to track, default to `None` to track all markers. In tracking mode, a region search is successful only if a selected marker is found
+        :type id_filter: callable
+        :return: `(corners, ids)` as returned by `cv2.aruco.detectMarkers`
+        """
+        self._since_full += 1
+        roi = self.track and self._boxes and self._since_full < self.full_every and self._roi(img.shape)
+        if roi and roi[2]-roi[0] > 16 and roi[3]-roi[1] > 16:
+            x0, y0, x1, y1 = roi
+            # min marker size is relative to the image size, keep it for the region, or noise in the small region
+            # would be taken as candidates, which costs more than searching the full frame
+            self._roi_parameters.minMarkerPerimeterRate = max(self._perimeter * .5 / max(x1-x0, y1-y0), self.parameters.minMarkerPerimeterRate)
+            corners, ids = self._detect(img[y0:y1, x0:x1], roi=True)[:2]
+            if ids is not None:
+                corners = tuple(c + np.array((x0, y0), np.float32) for c in corners)
+                if self._update(corners, ids, id_filter):
+                    return corners, ids
+        self._since_full = 0
+        corners, ids = self._detect(img)[:2]
+        self._update(corners, ids, id_filter)
+        return corners, ids
+
+    def _update(self, corners, ids, id_filter):
+        pts = [c.reshape(-1, 2) for c, id in zip(corners, ids if ids is not None else ()) if not id_filter or id_filter(id[0])]
+        if not pts:
+            self._boxes = []
+            return False
+        self._perimeter = min(sum(self.edges(p)) for p in pts)
+        pts = np.concatenate(pts)
+        box = (*pts.min(axis=0), *pts.max(axis=0))
+        self._boxes = [self._boxes[-1] if self._boxes else box, box]
+        return True
 
     def draw_labels(self, img, corners, ids):
         aruco.drawDetectedMarkers(img, corners, ids)
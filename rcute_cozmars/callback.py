@@ -0,0 +1,93 @@
+import asyncio
+import time
+import weakref
+from collections import deque
+from .util import logger
+
+class CallbackDispatcher:
+    """Runs event callbacks (e.g. :data:`TouchSensor.when_touched`) without blocking the reception of sensor events
+
+    Callbacks of the same sensor run one after another in the order of the events, callbacks of different sensors run concurrently.
+    In sync/async mode, non-coroutine callbacks run in a pool of at most :data:`workers` threads.
+
+    When a sensor has more than :data:`max_pending` callbacks waiting, the oldest ones are dropped.
+    For high-rate state events (e.g. the IR sensors), only the latest pending callback is kept.
+    """
+    def __init__(self, device, workers=4, max_pending=32, delay_threshold=.1):
+        self._device = weakref.proxy(device)
+        self.workers = workers
+        """Max number of threads running callbacks in sync/async mode, default to 4. Takes effect before the first callback"""
+        self.max_pending = max_pending
+        """Max number of callbacks waiting for each sensor, default to 32"""
+        self.delay_threshold = delay_threshold
+        """Callbacks started later than this (seconds) after the event are counted as delayed, default to 0.1"""
+        self._executor = None
+        self._queues = {}
+        self._tasks = {}
+        self.reset()
+
+    def reset(self):
+        """Reset counters"""
+        self._counters = {'called': 0, 'errors': 0, 'dropped': 0, 'coalesced': 0, 'delayed': 0}
+        self._max_delay = 0
+
+    def dispatch(self, key, cb, *args, coalesce=False):
+        # queue `cb(*args)` behind pending callbacks of sensor `key`
+        if not cb:
+            return
+        q = self._queues.get(key)
+        if q is None:
+            q = self._queues[key] = deque()
+        if coalesce and q:
+            self._counters['coalesced'] += len(q)
+            q.clear()
+        elif len(q) >= self.max_pending:
+            q.popleft()
+            self._counters['dropped'] += 1
+        q.append((cb, args, time.monotonic()))
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key, q))
+
+    async def _run(self, key, q):
+        try:
+            while q:
+                cb, args, t = q.popleft()
+                delay = time.monotonic() - t
+                self._max_delay = max(self._max_delay, delay)
+                if delay > self.delay_threshold:
+                    self._counters['delayed'] += 1
+                self._counters['called'] += 1
+                try:
+                    if asyncio.iscoroutinefunction(cb):
+                        await cb(*args)
+                    elif self._device._mode == 'aio':
+                        cb(*args)
+                    else:
+                        await asyncio.get_running_loop().run_in_executor(self._get_executor(), cb, *args)
+                except Exception as e:
+                    self._counters['errors'] += 1
+                    logger.exception(e)
+        finally:
+            self._tasks.pop(key, None)
+
+    def _get_executor(self):
+        if not self._executor:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='rcute-callback')
+        return self._executor
+
+    def close(self):
+        # drop pending callbacks, running ones are not interrupted
+        for t in self._tasks.values():
+            t.cancel()
+        self._tasks.clear()
+        self._queues.clear()
+        self._executor and self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def summary(self):
+        """:return: dict of callback counters since last reset, the number of pending callbacks, and the max delay (seconds) from event to callback"""
+        s = dict(self._counters)
+        s['pending'] = sum(len(q) for q in self._queues.values())
+        s['max_delay'] = self._max_delay
+        return s
@@ -1,26 +1,264 @@
+import asyncio
+import time
+import weakref
+from collections import deque
 from . import util
+from wsmprpc import RPCStream
 import numpy as np
-import cv2
+
+def _decode(data, flip=False, gray=False, scale=1):
+    import cv2
+    # let libjpeg decode at 1/2, 1/4 or 1/8 size, which is much faster than decoding at full size and resizing
+    reduce = next((r for r in (8, 4, 2) if scale * r <= 1), 1)
+    if reduce > 1:
+        flag = getattr(cv2, f'IMREAD_REDUCED_{"GRAYSCALE" if gray else "COLOR"}_{reduce}')
+    else:
+        flag = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+    im = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if scale * reduce != 1:
+        h, w = im.shape[:2]
+        im = cv2.resize(im, (round(w*scale*reduce), round(h*scale*reduce)), interpolation=cv2.INTER_AREA)
+    return cv2.flip(im, -1) if flip else im
+
+class Frame:
+    """A frame of the camera video stream
+
+    The JPEG data is decoded in a worker thread when the frame is first read, and the image is shared by all buffers reading the frame in the same format.
+    Frames dropped before being read are never decoded.
+    """
+    def __init__(self, jpeg, seq=0, captured_at=None, clock_offset=0):
+        self.jpeg = jpeg
+        """JPEG data as received from the robot, note that it's upside down"""
+        self.seq = seq
+        """Sequence number of the frame, increasing by 1 for each frame received by the camera"""
+        self.received_at = time.time()
+        """Time when the frame is received, in seconds since the epoch"""
+        self.captured_at = captured_at
+        """Time when the frame is captured, in seconds since the epoch of the robot's clock. `None` if the robot doesn't send it"""
+        self.time = self.received_at if captured_at is None else captured_at + clock_offset
+        """Time when the frame is captured on this computer's clock, in seconds since the epoch, to compare with e.g. `time.time()`.
+        It's :data:`captured_at` corrected for the difference between the robot's clock and this computer's, or :data:`received_at` if the robot doesn't send the capture time"""
+        self._images = {}
+        self._stats = None
+
+    async def image(self, executor=None, gray=False, scale=1, flip=True):
+        """:return: decoded image, see :meth:`Camera.get_buffer` for the parameters
+        :rtype: numpy.ndarray
+        """
+        fmt = gray, scale, flip
+        if fmt not in self._images:
+            self._images[fmt] = asyncio.get_running_loop().run_in_executor(executor, self._decode, flip, gray, scale)
+        return await asyncio.shield(self._images[fmt])
+
+    def _decode(self, *args):
+        t = time.perf_counter()
+        im = _decode(self.jpeg, *args)
+        if self._stats:
+            self._stats.decode_time += time.perf_counter() - t
+        return im
+
+class _Discard:
+    # stands in for the response stream of a cancelled RPC call
+    def force_put_nowait(self, o):
+        pass
 
 class CameraMultiplexOutputStream(util.MultiplexOutputStream):
+    def __init__(self, component):
+        util.MultiplexOutputStream.__init__(self, component)
+        self._seq = 0
+        # totals of all buffers, and arrival times of recent frames, for the adaptive controller
+        self.received = self.dropped = 0
+        self.decode_time = 0
+        self.arrivals = deque(maxlen=100)
+        self._offsets = deque(maxlen=100)
+        self._draining = []
+
     def force_put_nowait(self, o):
         if not isinstance(o, Exception):
-            o = cv2.flip(cv2.imdecode(np.frombuffer(o, dtype=np.uint8), cv2.IMREAD_COLOR), -1)
-        util.MultiplexOutputStream.force_put_nowait(self, o)
+            # a frame of the new stream means that the streams cancelled by `Camera.reconfigure` have ended, forget them
+            while self._draining:
+                self._component._rpc._tasks.pop(self._draining.pop(), None)
+            self._seq += 1
+            self.arrivals.append(time.monotonic())
+            # servers sending capture time send (jpeg, timestamp)
+            if isinstance(o, bytes):
+                o = Frame(o, self._seq)
+            else:
+                # the robot's clock isn't synchronized with ours: the smallest difference of receiving and capture time of recent frames
+                # is the clock offset plus the shortest transfer time, which is close to the offset on a local network
+                self._offsets.append(time.time() - o[1])
+                o = Frame(o[0], self._seq, o[1], min(self._offsets))
+            o._stats = self
+        self._output_streams and util.MultiplexOutputStream.force_put_nowait(self, o)
+
+class CameraOutputStream(util.OutputStream):
+    """Camera video stream, reading it returns decoded images, or JPEG data in raw mode"""
+    def __init__(self, parent, maxsize=0, raw=False, gray=False, scale=1, flip=True):
+        util.OutputStream.__init__(self, parent, maxsize)
+        if not 0 < scale <= 1:
+            raise ValueError('scale out of range (0, 1]')
+        self._raw = raw
+        self._format = {'gray': gray, 'scale': scale, 'flip': flip}
+        self.received = 0
+        """Number of frames put into the buffer"""
+        self.dropped = 0
+        """Number of frames dropped because the buffer was full, i.e. they were not read in time"""
+        self.latency = None
+        """Seconds from receiving to returning the last frame read, including time waiting in the buffer and decoding"""
+        self.last_frame = None
+        """The last :class:`Frame` read"""
+
+    def force_put_nowait(self, o):
+        if isinstance(o, Frame):
+            full = self.full()
+            self.received += 1
+            self.dropped += full
+            self._parent.received += 1
+            self._parent.dropped += full
+        RPCStream.force_put_nowait(self, o)
+
+    async def _output(self, frame):
+        im = frame.jpeg if self._raw else await frame.image(self._parent._component._get_executor(), **self._format)
+        self.last_frame = frame
+        self.latency = time.time() - frame.received_at
+        return im
+
+    async def __anext__(self):
+        return await self._output(await RPCStream.__anext__(self))
+
+    @util.mode()
+    async def read_frame(self):
+        """Read the next :class:`Frame` from the stream"""
+        return await RPCStream.__anext__(self)
+
+    @util.mode()
+    async def read_after(self, t):
+        """Read the first frame captured after time `t`, e.g. to get an image taken after a motion command has finished:
+
+        .. code:: python
+
+            robot.forward(1)
+            im = buf.read_after(time.time())
+
+        Capture time is compared on this computer's clock, see :data:`Frame.time`.
+
+        :param t: time in seconds since the epoch
+        :type t: float
+        """
+        while True:
+            frame = await RPCStream.__anext__(self)
+            if frame.time >= t:
+                return await self._output(frame)
 
 class Camera(util.MultiplexOutputStreamComponent):
     """ """
+    _output_stream = CameraOutputStream
+
     def __init__(self, robot, resolution=(480,360), frame_rate=3, q_size=1):
         util.MultiplexOutputStreamComponent.__init__(self, robot, q_size, CameraMultiplexOutputStream(self))
         self._frame_rate = frame_rate
         self._resolution = resolution
         self._standby = False
+        self._executor = None
+        self._adaptive = self._adaptive_task = None
+        self._stats_since = 0, weakref.WeakKeyDictionary()
+        # open recorders, closed on disconnect
+        self._recorders = weakref.WeakSet()
+        self.decode_workers = 2
+        """Number of threads decoding camera images, default to 2. Takes effect before the camera is first used"""
+        self.quality = None
+        """JPEG quality (1~100) of the video stream, default to `None` to use the robot's default. Use :meth:`reconfigure` to change it on a running stream
+
+        .. note::
+
+            The robot's server must support it
+        """
+
+    def get_buffer(self, raw=False, gray=False, scale=1, flip=True):
+        """Get video stream buffer
+
+        Each frame is decoded once for each distinct format (`gray`, `scale`, `flip`) requested by the buffers, so buffers of the same format share the image, which must not be modified in place.
+
+        :param raw: if `True`, the buffer returns JPEG data as received from the robot instead of decoded images, saving the cost of decoding. Note that the raw images are upside down. Default to `False`
+        :type raw: bool
+        :param gray: decode to grayscale images, default to `False`
+        :type gray: bool
+        :param scale: scale of images to the :data:`resolution`, in range (0, 1]. 1/2, 1/4 and 1/8 are the fastest, other values are decoded at the next larger of these sizes and then resized. Default to 1
+        :type scale: float
+        :param flip: rotate images by 180 degrees, because the camera is mounted upside down. Default to `True`
+        :type flip: bool
+        :rtype: :class:`CameraOutputStream`
+        """
+        return util.MultiplexOutputStreamComponent.get_buffer(self, raw=raw, gray=gray, scale=scale, flip=flip)
+
+    def get_recorder(self, file, **options):
+        """Get a :class:`rcute_cozmars.recorder.Recorder` to record the video stream to `file`, without decoding or re-encoding the images
+
+        .. code:: python
+
+            with robot.camera.get_recorder('video.avi'):
+                time.sleep(60)
+
+        :param file: path of the video file, `.avi` for MJPEG AVI, or `.mjpeg` for concatenated JPEG images
+        :type file: str
+        :param options: see :class:`rcute_cozmars.recorder.Recorder`
+        """
+        from .recorder import Recorder
+        return Recorder(self, file, **options)
+
+    def get_preview_server(self, **options):
+        """Get a :class:`rcute_cozmars.preview.PreviewServer` serving the video stream over HTTP to browsers
+
+        .. code:: python
+
+            with robot.camera.get_preview_server(port=8000) as server:
+                print(server.url)
+                time.sleep(60)
+
+        :param options: see :class:`rcute_cozmars.preview.PreviewServer`
+        """
+        from .preview import PreviewServer
+        return PreviewServer(self, **options)
+
+    def _stats(self, reset=False):
+        # counters since last reset, the buffers' own counters are kept
+        mux = self._multiplex_output_stream
+        seq, last = self._stats_since
+        bufs = mux._output_streams
+        s = {'frames': mux._seq - seq,
+            'buffers': [{'received': b.received - last.get(b, (0, 0))[0], 'dropped': b.dropped - last.get(b, (0, 0))[1], 'latency': b.latency} for b in bufs]}
+        if self._adaptive:
+            s['adaptive'] = self._adaptive.summary()
+        if reset:
+            self._stats_since = mux._seq, weakref.WeakKeyDictionary((b, (b.received, b.dropped)) for b in bufs)
+        return s
+
+    @util.mode(property_type='setter')
+    async def adaptive(self, *args):
+        """:class:`rcute_cozmars.adaptive.AdaptiveController` that adjusts frame rate, resolution and JPEG quality of the video stream while it's running, default to `None`
+
+        .. code:: python
+
+            from rcute_cozmars.adaptive import AdaptiveController
+            robot.camera.adaptive = AdaptiveController(max_frame_rate=15)
+        """
+        if not args:
+            return self._adaptive
+        self._adaptive_task and self._adaptive_task.cancel()
+        self._adaptive = args[0]
+        self._adaptive_task = args[0] and asyncio.create_task(args[0]._run(self))
+
+    def _get_executor(self):
+        if not self._executor:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(self.decode_workers, thread_name_prefix='rcute-camera')
+        return self._executor
 
     @property
     def resolution(self):
         """the default is `(480, 360)`
 
-        Resolution cannot be modified after the camera has been opened, otherwise an exception will be thrown
+        Resolution cannot be modified after the camera has been opened, otherwise an exception will be thrown. Use :meth:`reconfigure` to change it on a running stream
         """
         return self._resolution
 
@@ -28,27 +266,60 @@ class Camera(util.MultiplexOutputStreamComponent):
     def frame_rate(self):
         """default is `3` FPS
 
-        Frame rate cannot be modified after the camera has been opened, otherwise an exception will be thrown
+        Frame rate cannot be modified after the camera has been opened, otherwise an exception will be thrown. Use :meth:`reconfigure` to change it on a running stream
         """
         return self._frame_rate
 
     @resolution.setter
     def resolution(self, res):
         if not self.closed:
-            raise RuntimeError('Cannot set resolution while camera is running')
+            raise RuntimeError('Cannot set resolution while camera is running, use reconfigure() instead')
         self._resolution = res
 
     @frame_rate.setter
     def frame_rate(self, fr):
         if not self.closed:
-            raise RuntimeError('Cannot set frame_rate while camera is running')
+            raise RuntimeError('Cannot set frame_rate while camera is running, use reconfigure() instead')
         self._frame_rate = fr
 
+    @util.mode()
+    async def reconfigure(self, resolution=None, frame_rate=None, quality=None):
+        """Change resolution, frame rate and/or JPEG quality, also while the video stream is running
+
+        A running stream is restarted on the robot with the new settings, while the buffers stay open and just see a short gap between frames.
+
+        :param resolution: new resolution, default to `None` for unchanged
+        :type resolution: tuple
+        :param frame_rate: new frame rate, default to `None` for unchanged
+        :type frame_rate: float
+        :param quality: new JPEG quality, default to `None` for unchanged, see :data:`quality`
+        :type quality: int
+        """
+        if (resolution is None or tuple(resolution) == tuple(self._resolution)) and (frame_rate is None or frame_rate == self._frame_rate) and (quality is None or quality == self.quality):
+            return
+        self._resolution = resolution or self._resolution
+        self._frame_rate = frame_rate or self._frame_rate
+        self.quality = quality or self.quality
+        self._restart()
+
+    def _restart(self):
+        # restart a running stream with the current settings
+        if not self.closed:
+            old = self._stream_rpc
+            # detach the old stream before cancelling it, so that the buffers neither get its cancellation error nor frames in flight.
+            # The RPC client keeps it until a frame of the new stream arrives, the frames in flight before that are dropped
+            old._response_stream = _Discard()
+            old.cancel()
+            self._multiplex_output_stream._draining.append(old._msgid)
+            self._stream_rpc = self._get_rpc()
+            self._stream_rpc.request()
+
     def _get_rpc(self):
         if self._standby:
             raise RuntimeError('Cannot get video stream buffer while in capture standby mode')
         w, h = self.resolution
-        return self._rpc.camera(w, h, self.frame_rate, response_stream=self._multiplex_output_stream)
+        args = (w, h, self.frame_rate) if self.quality is None else (w, h, self.frame_rate, self.quality)
+        return self._rpc.camera(*args, response_stream=self._multiplex_output_stream)
 
     @util.mode()
     async def capture(self, output=None, **options):
@@ -73,9 +344,97 @@ class Camera(util.MultiplexOutputStreamComponent):
         self._standby = op.get('standby', False)
         data = await self._rpc.capture(op)
         if output is None:
-            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), _decode, data)
         elif isinstance(output, str):
             with open(output, 'wb') as file:
                 file.write(data)
         else:
             output.write(data)
+
+    @util.mode()
+    async def capture_burst(self, n, interval=0, output=None, raw=False, delay=None):
+        """Take a burst of photos, or a time-lapse with `interval`
+
+        Photos are taken from the video stream, which is started once for the whole burst at :data:`resolution`, instead of one :meth:`capture` call per photo.
+        Photos are decoded and saved in worker threads while the next ones are taken. If the video stream is already running, photos are taken from it without changing the frame rate.
+
+        .. code:: python
+
+            robot.camera.capture_burst(100, .5, 'photo{:03d}.jpg')
+
+        :param n: number of photos
+        :type n: int
+        :param interval: min seconds between photos, default to 0 for as fast as the :data:`frame_rate`. The video stream is started at `1/interval` FPS if it's slower
+        :type interval: float
+        :param output: default to `None`. A path with a format field such as `'photo{:03d}.jpg'` to save photo i to `output.format(i)`, or a function that is called with `(i, photo)` in a worker thread as each photo is taken
+        :type output: str/callable, optional
+        :param raw: if `True`, photos are JPEG data as received from the robot, which are upside down, instead of decoded images. Default to `False`
+        :type raw: bool
+        :param delay: seconds to let the camera warm up before taking the first photo, default to `None` for 1 if the video stream is not running, otherwise 0
+        :type delay: float
+        :return: If :data:`output` is None, a list of the photos; if it's a path, a list of the files
+        :raises RuntimeError: when the camera is in capture standby mode
+        """
+        if self._standby:
+            raise RuntimeError('Cannot take burst photos while in capture standby mode')
+        streaming = not self.closed
+        delay = (0 if streaming else 1) if delay is None else delay
+        # a stream started for the burst runs at `1/interval` FPS if it's slower, :data:`frame_rate` itself isn't changed
+        slow = not streaming and interval and 1 / interval < self._frame_rate
+        from concurrent.futures import ThreadPoolExecutor
+        # one thread, so that photos are saved or passed to `output` in order, while decoding runs in the camera's threads
+        writer = ThreadPoolExecutor(1, thread_name_prefix='rcute-burst')
+        buf = self._output_stream(self._multiplex_output_stream, maxsize=0, raw=True)
+        results, tasks = [], []
+        try:
+            frame_rate = self._frame_rate
+            try:
+                if slow:
+                    self._frame_rate = 1 / interval
+                await buf.open()
+            finally:
+                self._frame_rate = frame_rate
+            start = last = None
+            while len(results) < n:
+                frame = await buf.read_frame()
+                t = frame.time
+                start = start or t
+                # a little tolerance for jitter of the frame times
+                if t - start < delay or last is not None and t - last < interval * .9:
+                    continue
+                last = t
+                photo = frame.jpeg if raw else asyncio.ensure_future(frame.image(self._get_executor()))
+                raw or tasks.append(photo)
+                if output:
+                    photo = asyncio.ensure_future(self._output_burst(writer, output, len(results), photo, results[-1] if results else None))
+                    tasks.append(photo)
+                results.append(photo)
+            await buf.close()
+            results = [r if isinstance(r, bytes) else await r for r in results]
+            return results if not callable(output) else None
+        finally:
+            await buf.close()
+            # buffers opened during the burst keep the stream running, at the frame rate they expect
+            slow and not self.closed and self._restart()
+            # decoding and saving still pending if the burst is interrupted
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.shutdown(wait=False)
+
+    async def _output_burst(self, writer, output, i, photo, prev):
+        photo = photo if isinstance(photo, bytes) else await photo
+        prev and (await prev)
+        if callable(output):
+            return await asyncio.get_running_loop().run_in_executor(writer, output, i, photo)
+        return await asyncio.get_running_loop().run_in_executor(writer, self._save_burst, output.format(i), photo)
+
+    @staticmethod
+    def _save_burst(file, photo):
+        if isinstance(photo, bytes):
+            with open(file, 'wb') as f:
+                f.write(photo)
+        else:
+            import cv2
+            cv2.imwrite(file, photo)
+        return file
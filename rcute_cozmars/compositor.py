@@ -0,0 +1,259 @@
+"""
+Compose the screen from layers, so that the eyes, sprites, text and overlays can be shown together, see :data:`rcute_cozmars.screen.Screen.compositor`
+
+.. code:: python
+
+    with robot.screen.compositor as comp:
+        comp.layer('overlay').fill('red', 220, 5, 15, 15)
+        comp.layer('text').text('hello', y=100, size=20)
+        time.sleep(10)
+
+Layers are drawn from bottom to top by their `z`, the default layers are `'eyes'` (0), `'sprites'` (10), `'text'` (20) and `'overlay'` (30).
+While the compositor is open, the eye animation draws in the `'eyes'` layer instead of on the screen directly.
+
+Drawing on a layer only marks the region as changed. The compositor recomposes the changed regions of all layers into one frame,
+and sends the pixels that changed on screen, at most :data:`Compositor.frame_rate` times per second.
+"""
+import asyncio
+import time
+import numpy as np
+from . import util
+from .util import logger
+
+class Layer:
+    """A layer of the screen, transparent until drawn on"""
+    def __init__(self, compositor, name, z):
+        self._compositor = compositor
+        self.name = name
+        """ """
+        self.z = z
+        """Layers with greater `z` are drawn on top"""
+        W, H = compositor._screen.resolution
+        self._image = np.zeros((H, W, 3), np.uint8)
+        self._opaque = np.zeros((H, W), bool)
+        self._visible = True
+        self._dirty = []
+
+    @property
+    def visible(self):
+        """default to `True`"""
+        return self._visible
+
+    @visible.setter
+    def visible(self, v):
+        if v != self._visible:
+            self._visible = v
+            self._invalidate(0, 0, *self._compositor._screen.resolution)
+
+    def _invalidate(self, x, y, w, h):
+        self._dirty.append((x, y, w, h))
+        self._compositor._wake()
+
+    def _clip(self, x, y, w, h):
+        W, H = self._compositor._screen.resolution
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x+w, W), min(y+h, H)
+        return (x0, y0, x1-x0, y1-y0) if x1 > x0 and y1 > y0 else None
+
+    def draw(self, image, x=0, y=0, mask=None):
+        """Draw an image on the layer, replacing what's drawn in the area
+
+        :param image: BGR image
+        :type image: numpy.ndarray
+        :param x: x coordinate of the upper left corner, default to 0
+        :type x: int
+        :param y: y coordinate of the upper left corner, default to 0
+        :type y: int
+        :param mask: array of the image's size, pixels where it's 0 are transparent. Default to `None` for an opaque image
+        :type mask: numpy.ndarray
+        """
+        h, w = image.shape[:2]
+        r = self._clip(x, y, w, h)
+        if not r:
+            return
+        cx, cy, cw, ch = r
+        src = np.s_[cy-y: cy-y+ch, cx-x: cx-x+cw]
+        self._image[cy: cy+ch, cx: cx+cw] = image[src]
+        self._opaque[cy: cy+ch, cx: cx+cw] = True if mask is None else mask[src] != 0
+        self._invalidate(*r)
+
+    def fill(self, color, x=0, y=0, w=240, h=135):
+        """Fill an area with color
+
+        :param color: BGR mode
+        :type color: str/tuple
+        """
+        r = self._clip(x, y, w, h)
+        if r:
+            cx, cy, cw, ch = r
+            self._image[cy: cy+ch, cx: cx+cw] = util.bgr(color)
+            self._opaque[cy: cy+ch, cx: cx+cw] = True
+            self._invalidate(*r)
+
+    def clear(self, x=0, y=0, w=240, h=135):
+        """Make an area transparent, default to the whole layer"""
+        r = self._clip(x, y, w, h)
+        if r:
+            cx, cy, cw, ch = r
+            self._opaque[cy: cy+ch, cx: cx+cw] = False
+            self._invalidate(*r)
+
+    def text(self, text, x=None, y=None, size=35, color='cyan', font=None):
+        """Draw text with transparent background
+
+        :param x: x coordinate of the upper left corner of the text, default to `None` to center it horizontally
+        :type x: int
+        :param y: y coordinate of the upper left corner of the text, default to `None` to center it vertically
+        :type y: int
+        :param size: font size, default is 35
+        :type size: int, optional
+        :param color: text color, default is cyan
+        :type color: str/tuple, optional
+        :param font: font file, see :meth:`rcute_cozmars.screen.Screen.text`
+        :type font: str, optional
+        :return: `(x, y, w, h)` of the area drawn, e.g. to :meth:`clear` it later
+        """
+        from PIL import Image, ImageDraw
+        from .screen import text_bbox
+        screen = self._compositor._screen
+        font = screen._font(font or util.resource('msyh.ttc'), size)
+        l, t, r, b = text_bbox(font, text)
+        w, h = r-l, b-t
+        if not w or not h:
+            return None
+        mask = Image.new('L', (w, h))
+        ImageDraw.Draw(mask).text((-l, -t), text, fill=255, font=font)
+        W, H = screen.resolution
+        x = (W-w)//2 if x is None else x
+        y = (H-h)//2 if y is None else y
+        # antialiased edges are kept where they're at least half covered
+        self.draw(np.full((h, w, 3), util.bgr(color), np.uint8), x, y, np.array(mask) > 127)
+        return x, y, w, h
+
+class Compositor(util.withmixin):
+    """Composes the screen from layers, see :data:`rcute_cozmars.screen.Screen.compositor`
+
+    :param screen: the screen
+    :param frame_rate: max number of screen updates per second, default to 20
+    :type frame_rate: float
+    :param background: color behind all layers, default to 'black'
+    :type background: str/tuple
+    """
+    def __init__(self, screen, frame_rate=20, background='black'):
+        self._screen = screen
+        self.frame_rate = frame_rate
+        """Max number of screen updates per second"""
+        self.background = background
+        """Color behind all layers, takes effect on the next update of each area"""
+        self._layers = {}
+        for name, z in (('eyes', 0), ('sprites', 10), ('text', 20), ('overlay', 30)):
+            self.layer(name, z)
+        self._task = self._event = None
+        self.updates = 0
+        """Number of screen updates"""
+
+    @property
+    def _lo(self):
+        return self._screen._lo
+
+    @property
+    def _mode(self):
+        return self._screen._mode
+
+    def _in_event_loop(self):
+        return self._screen._in_event_loop()
+
+    @property
+    def closed(self):
+        """ """
+        return not self._task
+
+    def layer(self, name, z=None):
+        """Get a layer, created if it doesn't exist
+
+        :param name: name of the layer
+        :type name: str
+        :param z: order of a new layer, default to `None` to put it on top
+        :type z: float
+        :rtype: :class:`Layer`
+        """
+        if name not in self._layers:
+            z = max((l.z for l in self._layers.values()), default=0) + 10 if z is None else z
+            self._layers[name] = Layer(self, name, z)
+        return self._layers[name]
+
+    @property
+    def layers(self):
+        """Layers from bottom to top"""
+        return sorted(self._layers.values(), key=lambda l: l.z)
+
+    @util.mode()
+    async def open(self):
+        """Start composing the screen, which is redrawn from the layers, and show the eyes if they're stopped or hidden"""
+        if not self._task:
+            self._event = asyncio.Event()
+            W, H = self._screen.resolution
+            self._frame = np.empty((H, W, 3), np.uint8)
+            eyes = self._layers['eyes']
+            # start with what's on screen, the eye animation only redraws the eyes when they move
+            if self._screen._frame is not None:
+                eyes.draw(self._screen._frame, 0, 0, self._screen._frame.any(axis=2))
+            eyes._invalidate(0, 0, W, H)
+            self._task = asyncio.create_task(self._run())
+            if self._screen._robot.eyes._expression in ('stopped', 'hidden'):
+                await self._screen._robot.eyes.show()
+
+    @util.mode()
+    async def close(self):
+        """Stop composing, the screen keeps showing the last frame"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _wake(self):
+        if self._event:
+            if self._in_event_loop():
+                self._event.set()
+            else:
+                # layers can be drawn on from other threads in sync/async mode
+                self._lo.call_soon_threadsafe(self._event.set)
+
+    def _compose(self, x, y, w, h):
+        region = self._frame[y: y+h, x: x+w]
+        region[:] = util.bgr(self.background)
+        for l in self.layers:
+            if l.visible:
+                m = l._opaque[y: y+h, x: x+w]
+                region[m] = l._image[y: y+h, x: x+w][m]
+
+    async def _run(self):
+        last = 0
+        while True:
+            await self._event.wait()
+            # changes made while waiting are sent together
+            delay = last + 1 / self.frame_rate - time.monotonic()
+            delay > 0 and (await asyncio.sleep(delay))
+            self._event.clear()
+            rects = []
+            for l in list(self._layers.values()):
+                # swapped in one step, rects added by the user meanwhile go to the new list
+                dirty, l._dirty = l._dirty, []
+                rects += dirty
+            if not rects:
+                continue
+            if len(rects) > self._screen.max_rects:
+                x0, y0 = min(r[0] for r in rects), min(r[1] for r in rects)
+                x1, y1 = max(r[0]+r[2] for r in rects), max(r[1]+r[3] for r in rects)
+                rects = [(x0, y0, x1-x0, y1-y0)]
+            for r in rects:
+                self._compose(*r)
+            last = time.monotonic()
+            try:
+                # the screen's framebuffer diff sends only the pixels that changed
+                await self._screen._update(self._frame.copy())
+                self.updates += 1
+            except ConnectionError:
+                # the full frame is sent on the next update after reconnecting
+                pass
+            except Exception as e:
+                logger.exception(e)
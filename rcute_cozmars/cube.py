@@ -1,15 +1,13 @@
 import asyncio
-import aiohttp
-import websockets
 import threading
 import logging
 import json
-from wsmprpc import RPCClient, RPCStream
-from . import util
+from wsmprpc import RPCStream
+from . import util, stats, reconnect, callback
 
 logger = logging.getLogger("rcute-cube")
 
-class AioCube:
+class AioCube(stats.statsmixin, reconnect.reconnectmixin):
     """Asynchronous (async/await) mode of Cube
 
     :param serial_or_ip: The IP address or serial number of the cube to be connected. Default to None, in which case the program will automatically detect the cube on connection if there's only one found.
@@ -18,9 +16,18 @@ class AioCube:
     def __init__(self, serial_or_ip=None):
         if serial_or_ip:
             self._host = 'rcute-cube-' + serial_or_ip + '.local' if len(serial_or_ip) == 4 else serial_or_ip
+        stats.statsmixin.__init__(self)
+        reconnect.reconnectmixin.__init__(self)
         self._mode = 'aio'
         self._state = 'moved'
         self._connected = False
+        self._session = None
+        self.http_timeout = 10
+        """Timeout (seconds) of HTTP requests to the cube, default to 10. Takes effect on next :meth:`connect`"""
+        self.http_limit = 2
+        """Max number of pooled HTTP connections to the cube, default to 2. Takes effect on next :meth:`connect`"""
+        self.callbacks = callback.CallbackDispatcher(self)
+        """Dispatcher running motion event callbacks, see :class:`rcute_cozmars.callback.CallbackDispatcher`"""
         self.last_action = None
         """The last action of the cube"""
         self.when_flipped = None
@@ -62,26 +69,34 @@ class AioCube:
             if not hasattr(self, '_event_thread'):
                 self._event_thread = threading.current_thread()
             if not hasattr(self, '_host'):
-                found = await util.find_service('rcute-cube-????', '_ws._tcp.local.')
-                assert len(found)==1, "More than one cube found." if found else "No cube found."
-                self._host = found[0].server
-            self._ws = await websockets.connect(f'ws://{self._host}:81')
-            if '-1' == await self._ws.recv():
-                raise RuntimeError("""Cannot connect to cube, please close other programs that are connecting cube""")
-            self._rpc = RPCClient(self._ws)
-            self._about = json.loads(await self._get('/about'))
+                self._host = await util.find_device('rcute-cube-????', 'cube')
+            # websocket is served on port 81, unless an explicit port is given (e.g. a mock server)
+            self._ws_url = 'ws://{}' if ':' in self._host else 'ws://{}:81'
+            await self._open_rpc(self._host)
+            self._session = util.http_session(self.http_timeout, self.http_limit)
+            try:
+                self._about = json.loads(await self._get('/about'))
+                util.cache_address(self._host, self._about['ip'])
+            except BaseException:
+                await self._close_session()
+                await self._ws.close()
+                raise
+            self._event_rpc = self._rpc.mpu_event()
             self._event_task = asyncio.create_task(self._get_event())
+            self._watch_task = asyncio.create_task(self._watch_connection())
             self._connected = True
 
-    async def _call_callback(self, cb, *args):
-        if cb:
-            if self._mode == 'aio':
-                (await cb(*args)) if asyncio.iscoroutinefunction(cb) else cb(*args)
-            else:
-                self._lo.run_in_executor(None, cb, *args)
+    _busy_error = 'Cannot connect to cube, please close other programs that are connecting cube'
 
-    async def _get_event(self):
+    def _suspend(self):
+        self._event_task.cancel()
+        return [self._event_rpc]
+
+    def _resume(self):
         self._event_rpc = self._rpc.mpu_event()
+        self._event_task = asyncio.create_task(self._get_event())
+
+    async def _get_event(self):
         async for event in self._event_rpc:
             try:
                 arg = event[1]
@@ -90,12 +105,17 @@ class AioCube:
                 else:
                     self.last_action = event[0], arg
                 if event[0] in ('static', 'moved', 'fall', 'tapped', 'shaken'):
-                    await self._call_callback(getattr(self, 'when_'+event[0]))
+                    self.callbacks.dispatch('mpu', getattr(self, 'when_'+event[0]))
                 else:
-                    await self._call_callback(getattr(self, 'when_'+event[0]), arg)
+                    self.callbacks.dispatch('mpu', getattr(self, 'when_'+event[0]), arg)
             except Exception as e:
                 logger.exception(e)
 
+    def _extra_stats(self, reset):
+        s = {'callbacks': self.callbacks.summary()}
+        reset and self.callbacks.reset()
+        return s
+
 
     @property
     def connected(self):
@@ -105,9 +125,15 @@ class AioCube:
     async def disconnect(self):
         """ """
         if self._connected:
+            self._watch_task.cancel()
+            self._stats_task and self._stats_task.cancel()
             self._event_rpc.cancel()
+            # the task may not be iterating the stream yet, and wouldn't get the cancellation
+            self._event_task.cancel()
             await asyncio.gather(self._event_task, return_exceptions=True)
+            self.callbacks.close()
             await self._ws.close()
+            await self._close_session()
             self._connected = False
 
     async def __aenter__(self):
@@ -142,10 +168,16 @@ class AioCube:
         """Serial Number of cube"""
         return self._about['serial']
 
+    async def _close_session(self):
+        session, self._session = self._session, None
+        session and (await session.close())
+
     async def _get(self, sub_url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get('http://' + self._host + sub_url) as resp:
-                return await resp.text()
+        url = 'http://' + self._addr + sub_url
+        if self._session:
+            return await util.http_get(self._session, url)
+        async with util.http_session(self.http_timeout, self.http_limit) as session:
+            return await util.http_get(session, url)
 
     @util.mode(property_type='setter')
     async def led(self, *args):
@@ -1,5 +1,6 @@
 # these animations are hard coded for 15r/m motors
 import asyncio
+import time
 import numpy as np
 import cv2
 from .aruco import ArucoDetector
@@ -11,8 +12,9 @@ def charger_id(id):
     return id == 0
 
 def exe(rec, image, id_filter, win):
-    corners, ids = rec.detect(image)
+    corners, ids = rec.detect(image, id_filter)
     if win:
+        image = image.copy() # shared with other buffers
         rec.draw_labels(image, corners, ids)
         cv2.imshow(win, image)
         cv2.waitKey(10)
@@ -22,10 +24,70 @@ def exe(rec, image, id_filter, win):
                 return corner.reshape(-1,2), id[0]
     return None, None
 
-async def detect_and_imshow(cam_buf, rec, id_filter, win=None):
-    image = await cam_buf.read()
+async def detect_and_imshow(cam_buf, rec, id_filter, win=None, after=None):
+    # `after`: skip frames captured before this time, e.g. before the robot stopped moving
+    image = await (cam_buf.read_after(after) if after else cam_buf.read())
     return await asyncio.get_running_loop().run_in_executor(None, exe, rec, image, id_filter, win)
 
+class DetectionPipeline:
+    """Detects markers in a worker thread continuously, always on the newest frame of the camera buffer,
+    so that frames are received and detected while the robot acts on the previous result
+
+    .. code:: python
+
+        async with DetectionPipeline(buf, ArucoDetector(), cube_id) as pipe:
+            corner, id, t = await pipe.next()
+    """
+    def __init__(self, cam_buf, rec, id_filter, win=None):
+        self._buf = cam_buf
+        self._rec = rec
+        self._id_filter = id_filter
+        self._win = win
+        self._result = self._last = None
+
+    async def __aenter__(self):
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='rcute-detection')
+        self._cond = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    async def _run(self):
+        lo = asyncio.get_running_loop()
+        try:
+            while True:
+                # camera buffers keep the newest frame (q_size=1 by default), older ones are dropped while detecting
+                image = await self._buf.read()
+                frame = getattr(self._buf, 'last_frame', None)
+                t = frame.time if frame else time.time()
+                corner, id = await lo.run_in_executor(self._executor, exe, self._rec, image, self._id_filter, self._win)
+                async with self._cond:
+                    self._result = corner, id, t
+                    self._cond.notify_all()
+        except Exception as e:
+            async with self._cond:
+                self._result = e
+                self._cond.notify_all()
+
+    async def next(self, after=None):
+        """Wait for a detection result that's not returned yet
+
+        :param after: if set, wait for a result of a frame captured after this time (seconds since the epoch, e.g. `time.time()`)
+        :return: `(corner, id, t)`, where `corner` and `id` are `None` if no marker is found, and `t` is the capture time of the frame, see :data:`rcute_cozmars.camera.Frame.time`
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._result is not self._last and
+                (isinstance(self._result, Exception) or not after or self._result[2] >= after))
+            if isinstance(self._result, Exception):
+                raise self._result
+            self._last = self._result
+            return self._result
+
 async def search_for_cube(robot, cam_buf=None, clockwise=True, reverse=2, rec=None, id_filter=cube_id, show_camera_view=False):
     rec = rec or ArucoDetector()
     if type(show_camera_view) != str:
@@ -33,13 +95,14 @@ async def search_for_cube(robot, cam_buf=None, clockwise=True, reverse=2, rec=No
     await robot.lift.height(0)
     await robot.head.angle(-15)
     try:
-        cam = cam_buf or robot.camera.get_buffer()
+        cam = cam_buf or robot.camera.get_buffer(gray=True)
         not cam_buf and (await cam.open())
         for _ in range(5):
             await cam.read() # let's discard the first few frames
         count = 0
+        after = None
         while True:
-            corner, id= await detect_and_imshow(cam, rec, id_filter, show_camera_view)
+            corner, id= await detect_and_imshow(cam, rec, id_filter, show_camera_view, after)
             if corner is not None:
                 return corner, id
             if count < reverse:
@@ -48,6 +111,7 @@ async def search_for_cube(robot, cam_buf=None, clockwise=True, reverse=2, rec=No
                 await robot.motors.set_speed((.5, -.5) if clockwise else (-.5, .5), 0.35 if count ==reverse else 0.1)
             count += 1
             await asyncio.sleep(.5)
+            after = time.time()
     finally:
         not cam_buf and (await cam.close())
 
@@ -58,27 +122,30 @@ async def center_cube(robot, cam_buf=None, rec=None, id_filter=cube_id, show_cam
     mid = [a/2 for a in robot.camera.resolution]
     # mid[0] += 40#offset
     try:
-        cam = cam_buf or robot.camera.get_buffer()
+        cam = cam_buf or robot.camera.get_buffer(gray=True)
         not cam_buf and (await cam.open())
 
-        while True:
-            corner, id= await detect_and_imshow(cam, rec, id_filter, show_camera_view)
-            if corner is None:
-                return corner, id
-            else:
-                av = np.average(corner, axis=0)
-                x, y = [av[i] - mid[i] for i in range(2)]
-                e = np.average(rec.edges(corner))
-                if not -70 < x < 70:
-                    sp = np.clip(.1*((x-50) if x >=50 else (50+x)), -.05, .05)
-                    await robot.motors.set_speed((max(0,sp), max(0,-sp)), max((100-e)/130, .05))
-                elif e < 50:
-                    await robot.motors.set_speed((.2,.2),max(.3, (50-e)/20))
-                elif e > 60:
-                    await robot.motors.set_speed((-.2,-.2),max(.3, (e-60)/25))
-                else:
+        async with DetectionPipeline(cam, rec, id_filter, show_camera_view) as pipe:
+            after = None
+            while True:
+                corner, id, _ = await pipe.next(after)
+                if corner is None:
                     return corner, id
-                await asyncio.sleep(.5)
+                else:
+                    av = np.average(corner, axis=0)
+                    x, y = [av[i] - mid[i] for i in range(2)]
+                    e = np.average(rec.edges(corner))
+                    if not -70 < x < 70:
+                        sp = np.clip(.1*((x-50) if x >=50 else (50+x)), -.05, .05)
+                        await robot.motors.set_speed((max(0,sp), max(0,-sp)), max((100-e)/130, .05))
+                    elif e < 50:
+                        await robot.motors.set_speed((.2,.2),max(.3, (50-e)/20))
+                    elif e > 60:
+                        await robot.motors.set_speed((-.2,-.2),max(.3, (e-60)/25))
+                    else:
+                        return corner, id
+                    await asyncio.sleep(.5)
+                    after = time.time()
     finally:
         not cam_buf and (await cam.close())
 
@@ -109,40 +176,44 @@ async def dock_with_cube(robot, cam_buf=None, rec=None, id_filter=cube_id, show_
     delay = 1 / robot.camera.frame_rate
     count = 0
     try:
-        cam = cam_buf or robot.camera.get_buffer()
+        cam = cam_buf or robot.camera.get_buffer(gray=True)
         not cam_buf and (await cam.open())
 
         sp = .5,.5
-        while True:
-            corner, id = await detect_and_imshow(cam, rec, id_filter, show_camera_view)
-            dist = await robot.sonar.distance()
-            if dist <= .06:
-                count += delay
-            else:
-                count = 0
-            if count > 1.5:
-                await robot.motors.stop()
-                break
-            if corner is not None:
-                x = np.average(corner, axis=0)[0] - mid
-                if x > 10:
-                    sp = 1, max(1-(x-10)/10, 0.05)
-                elif x < -10:
-                    sp = max(1-(-x-10)/10, 0.05), 1
+        # steer by frames captured after the last motion command, not before it took effect (or before docking started)
+        after = time.time()
+        async with DetectionPipeline(cam, rec, id_filter, show_camera_view) as pipe:
+            while True:
+                # read the sonar while waiting for the next detection
+                (corner, id, _), dist = await asyncio.gather(pipe.next(after), robot.sonar.distance())
+                if dist <= .06:
+                    count += delay
                 else:
-                    sp = 1, 1
-                if dist < .1:
-                    sp = tuple(s*dist/.1 for s in sp)
-            elif dist < .1:
-                sp = dist/.1, dist/.1
-            await robot.motors.speed(tuple(a*.2 for a in sp))
+                    count = 0
+                if count > 1.5:
+                    await robot.motors.stop()
+                    break
+                if corner is not None:
+                    x = np.average(corner, axis=0)[0] - mid
+                    if x > 10:
+                        sp = 1, max(1-(x-10)/10, 0.05)
+                    elif x < -10:
+                        sp = max(1-(-x-10)/10, 0.05), 1
+                    else:
+                        sp = 1, 1
+                    if dist < .1:
+                        sp = tuple(s*dist/.1 for s in sp)
+                elif dist < .1:
+                    sp = dist/.1, dist/.1
+                await robot.motors.speed(tuple(a*.2 for a in sp))
+                after = time.time()
     finally:
         not cam_buf and (await cam.close())
 
 async def pick_up_cube(robot, height=1, retry=3, id_filter=cube_id, show_camera_view=False):
     rec = ArucoDetector()
     show_camera_view = show_camera_view and 'pick_up_cube'
-    async with robot.camera.get_buffer() as buf:
+    async with robot.camera.get_buffer(gray=True) as buf:
         clockwise, reverse = True, 2
         while True:
             corner, id = await animations['search for cube'](robot, buf, clockwise=clockwise, reverse=reverse, rec=rec, id_filter=id_filter, show_camera_view=show_camera_view)
@@ -180,7 +251,7 @@ async def approach_charger(robot, cam_buf=None, rec=None, id_filter=charger_id,
     rec = rec or ArucoDetector()
     mid = robot.camera.resolution[0] /2 + offset
     try:
-        cam = cam_buf or robot.camera.get_buffer()
+        cam = cam_buf or robot.camera.get_buffer(gray=True)
         not cam_buf and (await cam.open())
 
         sp = 1, 1
@@ -227,7 +298,7 @@ async def dock_with_charger(robot, corner, rec=None):
 async def drive_on_charger(robot, show_camera_view=False):
     rec = ArucoDetector()
     show_camera_view = show_camera_view and 'drive_on_charger'
-    async with robot.camera.get_buffer() as buf:
+    async with robot.camera.get_buffer(gray=True) as buf:
         clockwise, reverse = True, 2
         while True:
             corner, id = await animations['search for cube'](robot, buf, clockwise=clockwise, reverse=reverse, rec=rec, id_filter=charger_id, show_camera_view=show_camera_view)
@@ -1,6 +1,5 @@
 import asyncio
 import numpy as np
-import cv2
 import random
 from . import util
 
@@ -29,6 +28,7 @@ class EyeAnimation(util.Component):
             return self._color
 
     def _create_eye(self):
+        import cv2
         color = self._color
         sr = self._size - self._radius -1
         cv2.circle(self._eye, (sr, sr), self._radius, color, -1)
@@ -98,8 +98,24 @@ class EyeAnimation(util.Component):
         await self._set_exp(exp or self._exp_before or 'auto')
         self._exp_before = None
 
+    async def _draw(self, image, x, y):
+        comp = self._robot.screen._compositor
+        if comp and not comp.closed:
+            # black is transparent, so that the eyes are drawn on the layers below
+            comp.layer('eyes').draw(image, x, y, image.any(axis=2))
+        else:
+            await self._robot.screen.block_display(image, x, y)
+
+    async def _clear(self):
+        comp = self._robot.screen._compositor
+        if comp and not comp.closed:
+            comp.layer('eyes').clear()
+        else:
+            await self._robot.screen.fill((0,0,0), stop_eyes=False)
+
     # very urgly coded eye animation
     async def animate(self, robot, start_exp=None):
+        import cv2
         self._color = util.bgr(self._robot.env.vars.get('eye_color', 'cyan'))
         self._canvas = np.zeros((134, 240, 3), np.uint8)
         self._ev = asyncio.Event()
@@ -123,7 +139,7 @@ class EyeAnimation(util.Component):
             except asyncio.TimeoutError:
                 pass
             if self._expression == 'hidden':
-                await robot.screen.fill((0,0,0), stop_eyes=False)
+                await self._clear()
                 self._ev.set()
                 while True:
                     self._expression = await self._exp_q.get()
@@ -220,7 +236,7 @@ class EyeAnimation(util.Component):
             if blink:
                 yt = oy1-(oy1-oy0)//3
                 self._canvas[oy0: yt, ox0: ox1] = (0, 0, 0)
-                await robot.screen.block_display(self._canvas[oy0: yt, ox0: ox1], ox0, oy0)
+                await self._draw(self._canvas[oy0: yt, ox0: ox1], ox0, oy0)
                 oy0 = yt
 
             self._canvas[oy0: oy1, ox0: ox1] = (0, 0, 0)
@@ -240,7 +256,7 @@ class EyeAnimation(util.Component):
             x0, y0, w, h = cv2.boundingRect(np.array([(lx0, ly0), (lx1, ly1), (rx0, ry0), (rx1, ry1)]))
             x1, y1 = x0+w, y0+h
             bx, by, bw, bh = cv2.boundingRect(np.array([(x0, y0), (x1-1, y1-1), (ox0, oy0), (ox1, oy1)]))
-            await robot.screen.block_display(self._canvas[by:by+bh, bx:bx+bw], bx, by)
+            await self._draw(self._canvas[by:by+bh, bx:bx+bw], bx, by)
 
             ox0, oy0, ox1, oy1 = x0, y0, x1, y1
             olpos, orpos = lpos, rpos
@@ -0,0 +1,185 @@
+"""
+Drive many robots and cubes from one process.
+
+:class:`AioFleet` connects all devices concurrently in the running event loop, and :class:`Fleet` is its sync facade,
+which runs the devices in a small pool of event loop threads instead of one thread for each device.
+
+.. code:: python
+
+    with Fleet(['ab12', 'cd34', 'ef56'], loops=2) as fleet:
+        fleet.set_lights('green')
+        fleet.robots[0].forward(1)
+        fleet.stop()
+"""
+import asyncio
+import threading
+from .robot import AioRobot, Robot, AsyncRobot
+from .cube import AioCube, Cube, AsyncCube
+
+def _aio(device):
+    # call the async/await implementation even for devices in sync/async mode
+    return AioRobot if isinstance(device, AioRobot) else AioCube
+
+async def _cancel_tasks():
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+class AioFleet:
+    """Robots and cubes in the same event loop
+
+    :param robots: robot instances or their serial numbers/IP addresses
+    :type robots: list
+    :param cubes: cube instances or their serial numbers/IP addresses
+    :type cubes: list
+    """
+    def __init__(self, robots=(), cubes=()):
+        self._robots = [r if isinstance(r, AioRobot) else AioRobot(r) for r in robots]
+        self._cubes = [c if isinstance(c, AioCube) else AioCube(c) for c in cubes]
+
+    @property
+    def robots(self):
+        """ """
+        return list(self._robots)
+
+    @property
+    def cubes(self):
+        """ """
+        return list(self._cubes)
+
+    def _devices(self, to):
+        return {'robots': self._robots, 'cubes': self._cubes, 'all': self._robots + self._cubes}[to]
+
+    async def connect(self):
+        """Connect all devices concurrently. If any of them fails, the others are disconnected and the error is raised"""
+        devices = self._devices('all')
+        results = await asyncio.gather(*(_aio(d).connect(d) for d in devices), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await self.disconnect()
+            raise errors[0]
+
+    async def disconnect(self):
+        """ """
+        await asyncio.gather(*(_aio(d).disconnect(d) for d in self._devices('all')), return_exceptions=True)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def broadcast(self, func, *args, to='robots', **kwargs):
+        """Call `func(device, *args, **kwargs)` on each device concurrently
+
+        :param func: coroutine function, or function returning an awaitable, e.g. `lambda r: r.lights.color('red')`
+        :type func: callable
+        :param to: 'robots', 'cubes' or 'all', default to 'robots'
+        :type to: str
+        :return: results in the order of devices
+        :rtype: list
+        """
+        return await asyncio.gather(*(func(d, *args, **kwargs) for d in self._devices(to)))
+
+    async def stop(self):
+        """Stop motors of all robots"""
+        await self.broadcast(lambda r: r.stop())
+
+    async def set_lights(self, color):
+        """Set lights color of all robots"""
+        await self.broadcast(lambda r: r.lights.color(color))
+
+class Fleet:
+    """Sync facade of :class:`AioFleet`
+
+    Devices are connected in `loops` background event loop threads, and can be used in sync (or async) mode as usual,
+    but must be disconnected by :meth:`disconnect` of the fleet instead of their own.
+
+    :param robots: serial numbers/IP addresses of robots
+    :type robots: list
+    :param cubes: serial numbers/IP addresses of cubes
+    :type cubes: list
+    :param loops: number of event loop threads, default to 1
+    :type loops: int
+    :param mode: 'sync' or 'async', the mode of the devices, default to 'sync'
+    :type mode: str
+    """
+    def __init__(self, robots=(), cubes=(), loops=1, mode='sync'):
+        robot_cls, cube_cls = (Robot, Cube) if mode == 'sync' else (AsyncRobot, AsyncCube)
+        self._robots = [robot_cls(r) for r in robots]
+        self._cubes = [cube_cls(c) for c in cubes]
+        # contiguous chunks, so that the results of sub-fleets concatenate in order
+        chunk = lambda l, i: l[len(l)*i//loops: len(l)*(i+1)//loops]
+        self._fleets = [AioFleet(chunk(self._robots, i), chunk(self._cubes, i)) for i in range(loops)]
+        self._loops = []
+        self._threads = []
+
+    @property
+    def robots(self):
+        """ """
+        return list(self._robots)
+
+    @property
+    def cubes(self):
+        """ """
+        return list(self._cubes)
+
+    def _run_all(self, coro_func, *args, **kwargs):
+        from concurrent.futures import wait
+        futs = [asyncio.run_coroutine_threadsafe(coro_func(f, *args, **kwargs), lo) for f, lo in zip(self._fleets, self._loops)]
+        # all sub-fleets finish before an error is raised
+        wait(futs)
+        return [r for fut in futs for r in (fut.result() or [])]
+
+    def connect(self):
+        """Connect all devices. If any of them fails, the others are disconnected and the error is raised"""
+        for _ in self._fleets:
+            lo = asyncio.new_event_loop()
+            t = threading.Thread(target=lo.run_forever, daemon=True)
+            t.start()
+            self._loops.append(lo)
+            self._threads.append(t)
+        try:
+            self._run_all(AioFleet.connect)
+        except Exception:
+            # a failed sub-fleet disconnects its own devices, the others are still connected
+            self._run_all(AioFleet.disconnect)
+            self._stop_loops()
+            raise
+
+    def disconnect(self):
+        """ """
+        self._run_all(AioFleet.disconnect)
+        self._stop_loops()
+
+    def _stop_loops(self):
+        # like asyncio.run, tasks left by the devices are cancelled before their loops are closed
+        for fut in [asyncio.run_coroutine_threadsafe(_cancel_tasks(), lo) for lo in self._loops]:
+            fut.result()
+        for lo in self._loops:
+            lo.call_soon_threadsafe(lo.stop)
+        for lo, t in zip(self._loops, self._threads):
+            t.join()
+            lo.close()
+        self._loops, self._threads = [], []
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.disconnect()
+
+    def broadcast(self, func, *args, to='robots', **kwargs):
+        """See :meth:`AioFleet.broadcast`, `func` is called in the event loop of each device"""
+        return self._run_all(AioFleet.broadcast, func, *args, to=to, **kwargs)
+
+    def stop(self):
+        """Stop motors of all robots"""
+        self._run_all(AioFleet.stop)
+
+    def set_lights(self, color):
+        """Set lights color of all robots"""
+        self._run_all(AioFleet.set_lights, color)
@@ -3,13 +3,13 @@ from . import util
 from .sound_mixin import soundmixin
 
 # import numpy as np
-from pydub import AudioSegment
 class MicrophoneMultiplexOutputStream(util.MultiplexOutputStream):
     def __init__(self, component):
         util.MultiplexOutputStream.__init__(self, component)
 
     def force_put_nowait(self, o):
         if not isinstance(o, Exception):
+            from pydub import AudioSegment
             # o = (np.frombuffer(o, dtype=self._dtype) * self._component.gain).tobytes()
             o = AudioSegment(data=o, sample_width=self._component.sample_width, frame_rate=self._component.sample_rate, channels=self._component.channels)
             o = o.apply_gain(self._component.gain)
@@ -0,0 +1,396 @@
+"""
+Local stand-in for the Cozmars robot and cube servers, for developing and benchmarking without hardware.
+
+The mock servers speak the same wsmprpc protocol and HTTP endpoints as the real ones, with configurable
+artificial latency, bandwidth and camera frame rate. Connect to them with the address they listen on:
+
+.. code:: python
+
+    async with mock_server.MockCozmars(latency=.02) as mock:
+        async with AioRobot(mock.address) as robot:
+            ...
+        print(mock.counters)
+
+or run a robot server from command line: ``python -m rcute_cozmars.mock_server --port 8080 --latency .02``
+
+.. note::
+
+    Only the client side is simulated faithfully: motors, servos, sensors etc. just remember the values they are given.
+"""
+import asyncio
+import json
+import time
+import random
+from collections import defaultdict
+from wsmprpc import RPCServer
+from .util import logger
+
+class _Link:
+    # websocket adapter for wsmprpc.RPCServer, delays and throttles messages sent to the client
+    def __init__(self, ws, latency, bandwidth):
+        self._ws = ws
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._q = asyncio.Queue()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def __aiter__(self):
+        import aiohttp
+        async for msg in self._ws:
+            if msg.type in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                yield msg.data
+
+    async def send(self, data):
+        if self._latency or self._bandwidth:
+            self._q.put_nowait((time.monotonic() + self._latency, data))
+        else:
+            await self._send(data)
+
+    async def _send(self, data):
+        await (self._ws.send_bytes(data) if isinstance(data, bytes) else self._ws.send_str(data))
+
+    async def _send_loop(self):
+        # keep order and pipelining: each message is delayed by latency, and by its transmission time if bandwidth is limited
+        while True:
+            due, data = await self._q.get()
+            delay = due - time.monotonic()
+            delay > 0 and (await asyncio.sleep(delay))
+            self._bandwidth and (await asyncio.sleep(len(data) / self._bandwidth))
+            try:
+                await self._send(data)
+            except Exception:
+                pass
+
+    def close(self):
+        self._sender.cancel()
+
+class _MockServer:
+    def __init__(self, host, port, latency, bandwidth, serial, prefix):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        """Artificial round trip latency (seconds) added to every message sent to the client"""
+        self.bandwidth = bandwidth
+        """Link bandwidth (bytes/second) from server to client, `None` for unlimited"""
+        self.serial = serial
+        self.counters = defaultdict(int)
+        """Counters of what the server has received and sent, e.g. `display_frames`, `camera_frames`, `speaker_underruns`"""
+        self._prefix = prefix
+        self._client = None
+        self._runner = None
+
+    @property
+    def address(self):
+        """`host:port` to connect to"""
+        return f'{self.host}:{self.port}'
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        self._add_routes(app, web)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f'{self.__class__.__name__} listening on {self.address}')
+
+    async def stop(self):
+        self._runner and (await self._runner.cleanup())
+        self._runner = None
+
+    async def drop(self):
+        """Close the connection to the client, to simulate a network failure"""
+        self._client and (await self._client._ws.close())
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def _about(self):
+        return {'hostname': f'{self._prefix}-{self.serial}', 'ip': self.host, 'version': 'mock', 'mac': '00:00:00:00:00:00', 'serial': self.serial}
+
+    async def _http_about(self, request):
+        from aiohttp import web
+        return web.Response(text=json.dumps(self._about()))
+
+    async def _http_ok(self, request):
+        from aiohttp import web
+        return web.Response(text='ok')
+
+    async def _ws(self, request):
+        from aiohttp import web
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        if self._client:
+            await ws.send_str('-1')
+            await ws.close()
+            return ws
+        await ws.send_str('0')
+        self._client = link = _Link(ws, self.latency, self.bandwidth)
+        try:
+            await RPCServer(link, self).run()
+        except Exception as e:
+            logger.debug(e)
+        finally:
+            link.close()
+            self._client = None
+        return ws
+
+class MockCozmars(_MockServer):
+    """Mock Cozmars robot server
+
+    :param host: default to '127.0.0.1'
+    :param port: default to 0, which means any free port, see :data:`address`
+    :param latency: artificial round trip latency in seconds, default to 0
+    :param bandwidth: bytes/second from server to client, default to `None` for unlimited
+    :param camera_fps: if set, camera streams at this frame rate regardless of the requested one
+    :param camera_timestamps: send capture time with camera frames, default to `False`
+    :param serial: serial number, default to '0000'
+    :param env: env-vars, default to `{}`
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, camera_fps=None, camera_timestamps=False, serial='0000', env=None):
+        _MockServer.__init__(self, host, port, latency, bandwidth, serial, 'rcute-cozmars')
+        self.camera_fps = camera_fps
+        self.camera_timestamps = camera_timestamps
+        self.env = env or {}
+        self._state = {'speed': (0, 0), 'head': 0, 'lift': 0, 'led_color': ((0,0,0),)*2, 'led_brightness': (.05,)*2,
+            'backlight': 1, 'distance': .5, 'max_distance': .5, 'distance_threshold': .1, 'microphone_volume': 100,
+            'speaker_volume': 50, 'double_press_threshold': .3, 'long_press_threshold': 1, 'long_press_repeat': False}
+        self._events = asyncio.Queue()
+        self._frames = {}
+
+    def _add_routes(self, app, web):
+        app.add_routes([web.get('/rpc', self._ws), web.get('/about', self._http_about), web.get('/env', self._http_env),
+            web.get('/poweroff', self._http_ok), web.get('/reboot', self._http_ok)])
+
+    async def _http_env(self, request):
+        from aiohttp import web
+        return web.Response(text=json.dumps(self.env))
+
+    def emit(self, event, data):
+        """Send a sensor event to the client, e.g. `emit('pressed', True)`"""
+        self._events.put_nowait((event, data))
+
+    def _value(self, name, *args):
+        if args and args[0] is not None:
+            self._state[name] = args[0]
+            self.counters[name] += 1
+        else:
+            return self._state[name]
+
+    async def _delay(self, duration):
+        duration and (await asyncio.sleep(duration))
+
+    # RPC methods
+
+    async def sensor_data(self):
+        while True:
+            yield await self._events.get()
+
+    async def speed(self, value=None, duration=None):
+        if value is None:
+            return self._state['speed']
+        self._value('speed', tuple(o if v is None else v for v, o in zip(value, self._state['speed'])))
+        if duration:
+            await asyncio.sleep(duration)
+            self._state['speed'] = (0, 0)
+
+    async def head(self, angle=None, duration=None, speed=None):
+        return self._value('head', angle)
+
+    async def lift(self, height=None, duration=None, speed=None):
+        return self._value('lift', height)
+
+    def relax_head(self):
+        pass
+
+    def relax_lift(self):
+        pass
+
+    def led_color(self, color=None):
+        return self._value('led_color', color)
+
+    def led_brightness(self, brightness=None, *args):
+        return self._value('led_brightness', brightness)
+
+    def backlight(self, brightness=None, *args):
+        return self._value('backlight', brightness)
+
+    def distance(self):
+        return self._state['distance']
+
+    def max_distance(self, *args):
+        return self._value('max_distance', *args)
+
+    def distance_threshold(self, *args):
+        return self._value('distance_threshold', *args)
+
+    def double_press_threshold(self, *args):
+        return self._value('double_press_threshold', *args)
+
+    def long_press_threshold(self, *args):
+        return self._value('long_press_threshold', *args)
+
+    def long_press_repeat(self, *args):
+        return self._value('long_press_repeat', *args)
+
+    def microphone_volume(self, *args):
+        return self._value('microphone_volume', *args)
+
+    def speaker_volume(self, *args):
+        return self._value('speaker_volume', *args)
+
+    def get_env(self, name):
+        return self.env.get(name)
+
+    def set_env(self, name, value):
+        self.env[name] = value
+
+    def del_env(self, name):
+        self.env.pop(name, None)
+
+    def save_env(self):
+        pass
+
+    def fill(self, color, x, y, w, h):
+        self.counters['fill'] += 1
+
+    def pixel(self, x, y, color):
+        self.counters['pixel'] += 1
+
+    def display(self, data, x0, y0, x1, y1):
+        self.counters['display_frames'] += 1
+        self.counters['display_pixels'] += (x1-x0+1) * (y1-y0+1)
+        self.counters['display_bytes'] += len(data)
+
+    async def _jpeg_frames(self, w, h, quality=None):
+        # a few pre-encoded frames of a moving square, so that serving frames costs no CPU
+        key = w, h, quality
+        if key not in self._frames:
+            def encode():
+                import cv2
+                import numpy as np
+                frames = []
+                for i in range(8):
+                    im = np.full((h, w, 3), 80, np.uint8)
+                    s = min(w, h) // 4
+                    x = i * (w - s) // 7
+                    im[h//2-s//2: h//2+s//2, x: x+s] = (0, 200, 255)
+                    frames.append(cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, quality or 95])[1].tobytes())
+                return frames
+            self._frames[key] = await asyncio.get_running_loop().run_in_executor(None, encode)
+        return self._frames[key]
+
+    async def camera(self, w, h, fps, quality=None):
+        frames = await self._jpeg_frames(w, h, quality)
+        fps = self.camera_fps or fps
+        t = time.monotonic()
+        for i in range(2**62):
+            yield (frames[i % len(frames)], time.time()) if self.camera_timestamps else frames[i % len(frames)]
+            self.counters['camera_frames'] += 1
+            t += 1 / fps
+            await asyncio.sleep(max(0, t - time.monotonic()))
+
+    async def capture(self, options):
+        await self._delay(options.get('delay'))
+        w, h = options.get('resize') or (480, 360)
+        self.counters['capture'] += 1
+        return (await self._jpeg_frames(w, h, options.get('quality')))[0]
+
+    async def microphone(self, sr, dtype, block_size):
+        from .util import sample_width
+        block = bytes(block_size * sample_width(dtype))
+        t = time.monotonic()
+        while True:
+            t += block_size / sr
+            await asyncio.sleep(max(0, t - time.monotonic()))
+            yield block
+            self.counters['microphone_blocks'] += 1
+
+    async def speaker(self, sr, dtype, block_size, volume, *, request_stream):
+        # play blocks in real time, an underrun is counted when the next block arrives after the previous one finished playing
+        block_duration = block_size / sr
+        self.counters['speaker_streams'] += 1
+        t = None
+        async for block in request_stream:
+            now = time.monotonic()
+            if t is None:
+                t = now
+            elif now > t:
+                self.counters['speaker_underruns'] += 1
+                t = now
+            t += block_duration
+            self.counters['speaker_blocks'] += 1
+            # one block is buffered while the previous one is playing
+            await asyncio.sleep(max(0, t - block_duration - time.monotonic()))
+
+    def tone(self, tone, duration):
+        self.counters['tone'] += 1
+
+    async def play(self, *, request_stream):
+        async for tone in request_stream:
+            self.counters['tone'] += 1
+
+class MockCube(_MockServer):
+    """Mock cube server, the websocket and HTTP endpoints share one port
+
+    :param host: default to '127.0.0.1'
+    :param port: default to 0, which means any free port, see :data:`address`
+    :param latency: artificial round trip latency in seconds, default to 0
+    :param bandwidth: bytes/second from server to client, default to `None` for unlimited
+    :param serial: serial number, default to '0000'
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, serial='0000'):
+        _MockServer.__init__(self, host, port, latency, bandwidth, serial, 'rcute-cube')
+        self._rgb = (0, 0, 0)
+        self._events = asyncio.Queue()
+
+    def _add_routes(self, app, web):
+        app.add_routes([web.get('/', self._ws), web.get('/about', self._http_about)])
+
+    def emit(self, event, arg=None):
+        """Send an mpu event to the client, e.g. `emit('flipped', 90)`"""
+        self._events.put_nowait((event, arg))
+
+    def rgb(self, *args):
+        if args:
+            self._rgb = args
+            self.counters['rgb'] += 1
+        else:
+            return self._rgb
+
+    def mpu_acc(self):
+        return (random.gauss(0, .1), random.gauss(0, .1), -9.8 + random.gauss(0, .1))
+
+    async def mpu_event(self):
+        while True:
+            yield await self._events.get()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a mock Cozmars robot (or cube) server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='round trip latency in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/second from server to client')
+    parser.add_argument('--camera-fps', type=float, default=None)
+    parser.add_argument('--cube', action='store_true', help='run a cube server instead of a robot')
+    args = parser.parse_args()
+    async def run():
+        if args.cube:
+            server = MockCube(args.host, args.port, args.latency, args.bandwidth)
+        else:
+            server = MockCozmars(args.host, args.port, args.latency, args.bandwidth, args.camera_fps)
+        async with server:
+            await asyncio.Event().wait()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Serve the camera view over HTTP as an MJPEG stream, which can be watched in any browser without a desktop GUI, see :meth:`rcute_cozmars.camera.Camera.get_preview_server`
+
+Routes:
+
+* `/` - a page showing the stream
+* `/stream` - `multipart/x-mixed-replace` MJPEG stream
+* `/snapshot` - the latest JPEG image
+
+The camera streams only while someone is watching `/stream` or waiting for `/snapshot`, it's started for the first viewer and stopped after the last one leaves.
+Each frame is encoded at most once and the same data is sent to all viewers. A viewer that can't keep up skips to the latest frame instead of falling behind.
+"""
+import asyncio
+import time
+from . import util
+from .util import logger
+
+_PAGE = '''<!DOCTYPE html>
+<html><head><title>{title}</title></head>
+<body style="margin:0;background:#000;display:flex;justify-content:center;align-items:center;height:100vh">
+<img src="stream" style="max-width:100%;max-height:100%{style}">
+</body></html>'''
+
+class PreviewServer(util.withmixin):
+    """HTTP server of the camera view
+
+    :param camera: the camera
+    :param host: address to listen on, default to '127.0.0.1'. Use '0.0.0.0' to allow viewers from other computers
+    :type host: str
+    :param port: default to 0, which means any free port, see :data:`url`
+    :type port: int
+    :param max_viewers: max number of concurrent viewers of `/stream`, more are refused with status 503, default to 4
+    :type max_viewers: int
+    :param frame_rate: max frame rate sent to viewers, default to `None` for the camera's frame rate
+    :type frame_rate: float
+    :param process: function taking a decoded image and returning the image to show, e.g. with detection results drawn on it. It runs in a worker thread and mustn't modify its input in place. Default to `None`, in which case JPEG images are forwarded as received from the robot without being decoded, and they are upside down in `/stream` and `/snapshot` (the page at `/` rotates them)
+    :type process: callable
+    :param quality: JPEG quality of processed images, default to 80
+    :type quality: int
+    """
+    def __init__(self, camera, host='127.0.0.1', port=0, max_viewers=4, frame_rate=None, process=None, quality=80):
+        self._camera = camera
+        self.host = host
+        self.port = port
+        self.max_viewers = max_viewers
+        self.frame_rate = frame_rate
+        self.process = process
+        self.quality = quality
+        self.viewers = 0
+        """Number of current viewers"""
+        self.frames = 0
+        """Number of frames published to viewers"""
+        self._part = self._jpeg = None
+        self._task = self._runner = None
+        self._users = 0
+
+    @property
+    def _lo(self):
+        return self._camera._lo
+
+    @property
+    def _mode(self):
+        return self._camera._mode
+
+    def _in_event_loop(self):
+        return self._camera._in_event_loop()
+
+    @property
+    def url(self):
+        """URL of the page showing the stream"""
+        return f'http://{self.host}:{self.port}/'
+
+    @property
+    def closed(self):
+        """ """
+        return not self._runner
+
+    @util.mode()
+    async def open(self):
+        """Start serving"""
+        if self._runner:
+            return
+        from aiohttp import web
+        app = web.Application()
+        app.add_routes([web.get('/', self._http_page), web.get('/stream', self._http_stream), web.get('/snapshot', self._http_snapshot)])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._cond = asyncio.Condition()
+        logger.info(f'Camera view at {self.url}')
+
+    @util.mode()
+    async def close(self):
+        """Stop serving, viewers are disconnected"""
+        if self._runner:
+            runner, self._runner = self._runner, None
+            async with self._cond:
+                self._cond.notify_all()
+            await self._stop_stream()
+            await runner.cleanup()
+            getattr(self, '_executor', None) and self._executor.shutdown(wait=False)
+
+    async def _acquire(self):
+        # the first user starts the camera stream
+        self._users += 1
+        if not self._task:
+            self._buf = self._camera._output_stream(self._camera._multiplex_output_stream, maxsize=1, raw=True)
+            self._task = asyncio.create_task(self._run(self._buf))
+            await self._buf.open()
+
+    async def _release(self):
+        # and the last one stops it
+        self._users -= 1
+        if not self._users:
+            await self._stop_stream()
+
+    async def _stop_stream(self):
+        if self._task:
+            task, buf, self._task, self._part = self._task, self._buf, None, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await buf.close()
+
+    async def _run(self, buf):
+        lo = asyncio.get_running_loop()
+        last = 0
+        while True:
+            try:
+                frame = await buf.read_frame()
+                if self.frame_rate and time.monotonic() - last < .9 / self.frame_rate:
+                    continue
+                last = time.monotonic()
+                if self.process:
+                    im = await frame.image(self._camera._get_executor())
+                    jpeg = await lo.run_in_executor(self._get_executor(), self._encode, im)
+                else:
+                    jpeg = frame.jpeg
+                async with self._cond:
+                    self._jpeg = jpeg
+                    self._part = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(jpeg) + jpeg + b'\r\n'
+                    self.frames += 1
+                    self._cond.notify_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+
+    def _get_executor(self):
+        # one thread, so that frames are processed in order
+        if not getattr(self, '_executor', None):
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix='rcute-preview')
+        return self._executor
+
+    def _encode(self, im):
+        import cv2
+        im = self.process(im)
+        return cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    async def _http_page(self, request):
+        from aiohttp import web
+        style = '' if self.process else ';transform:rotate(180deg)'
+        return web.Response(text=_PAGE.format(title=self._camera._robot.serial, style=style), content_type='text/html')
+
+    async def _http_snapshot(self, request):
+        from aiohttp import web
+        if not self._task:
+            # the latest image is stale when nobody is watching, take a new one
+            frames = self.frames
+            try:
+                await self._acquire()
+                async with self._cond:
+                    await asyncio.wait_for(self._cond.wait_for(lambda: self.frames != frames or not self._runner), 10)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await self._release()
+        if self._jpeg is None:
+            raise web.HTTPServiceUnavailable(text='No image yet')
+        return web.Response(body=self._jpeg, content_type='image/jpeg')
+
+    async def _http_stream(self, request):
+        from aiohttp import web
+        if self.viewers >= self.max_viewers:
+            raise web.HTTPServiceUnavailable(text='Too many viewers')
+        self.viewers += 1
+        resp = web.StreamResponse(headers={'Content-Type': 'multipart/x-mixed-replace; boundary=frame', 'Cache-Control': 'no-cache'})
+        try:
+            await self._acquire()
+            await resp.prepare(request)
+            part = None
+            while self._runner:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: self._part is not part and self._part or not self._runner)
+                    part = self._part
+                if not self._runner:
+                    break
+                # frames published while writing are skipped, only the latest is sent next
+                await resp.write(part)
+            return resp
+        except ConnectionError:
+            return resp
+        finally:
+            self.viewers -= 1
+            await self._release()
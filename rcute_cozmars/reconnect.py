@@ -0,0 +1,98 @@
+import asyncio
+import time
+from . import util
+from .util import logger
+
+class _Offline:
+    # stands in for the RPC client of a dropped connection, so that commands fail fast instead of hanging
+    def __init__(self, msg):
+        self._msg = msg
+
+    def __getattr__(self, method):
+        raise ConnectionError(self._msg)
+
+def _fail_pending(rpc, keep=()):
+    # pending calls of a dead RPC client never complete: fail them, or detach them silently if they are to be resumed
+    err = ConnectionError('Connection lost')
+    for fut in list(getattr(rpc, '_tasks', {}).values()):
+        if fut.done():
+            continue
+        if fut in keep:
+            fut._response_stream = None
+            asyncio.Future.cancel(fut)
+        else:
+            fut._response_stream and fut._response_stream.force_put_nowait(err)
+            fut.set_exception(err)
+            fut.exception() # mark as retrieved, whoever awaits it still gets the error
+    getattr(rpc, '_tasks', {}).clear()
+
+class reconnectmixin:
+    """ """
+    def __init__(self):
+        self._watch_task = None
+        self.auto_reconnect = False
+        """Whether to reconnect automatically when the connection drops, default to `False`.
+
+        Reconnecting reuses the address, device info and env-vars of the last connection, and resumes event callbacks and open streams.
+        Commands issued while reconnecting raise :class:`ConnectionError`."""
+        self.reconnect_delay = (.05, 2)
+        """`(initial, max)` seconds to wait between reconnect attempts, the delay doubles after each failed attempt, default to `(.05, 2)`"""
+        self.reconnect_timeout = 60
+        """Seconds to keep trying to reconnect before giving up, default to 60. `None` to try forever"""
+        self.ping_interval = .5
+        """Seconds between keepalive pings of the connection when :data:`auto_reconnect` is enabled, default to 0.5. Takes effect on next connection"""
+        self.ping_timeout = 1
+        """When :data:`auto_reconnect` is enabled, the connection is considered lost when a ping isn't answered within this many seconds, default to 1. Takes effect on next connection.
+        A connection that drops without being closed, e.g. when Wi-Fi is lost, is noticed after at most `ping_interval + 2*ping_timeout` seconds"""
+
+    async def _open_rpc(self, host):
+        # short keepalive only when the connection is restored anyway, otherwise keep websockets' defaults
+        kw = dict(ping_interval=self.ping_interval, ping_timeout=self.ping_timeout, close_timeout=self.ping_timeout) if self.auto_reconnect else {}
+        self._addr, self._ws = await util.ws_connect(host, self._ws_url, **kw)
+        if '-1' == await self._ws.recv():
+            raise RuntimeError(self._busy_error)
+        self._rpc = self._rpc_client(self._ws)
+
+    async def _watch_connection(self):
+        while True:
+            await self._ws.wait_closed()
+            _fail_pending(self._rpc, self._suspend() if self.auto_reconnect else ())
+            if not self.auto_reconnect:
+                self._rpc = _Offline('Connection lost')
+                logger.warning(f'Lost connection to {self._host}')
+                return
+            self._rpc = _Offline('Connection lost, reconnecting')
+            logger.warning(f'Lost connection to {self._host}, reconnecting')
+            t = time.monotonic()
+            delay, max_delay = self.reconnect_delay
+            addr = self._addr
+            while True:
+                try:
+                    # an attempt can hang on a half-open connection, it mustn't outlast the deadline
+                    left = None if self.reconnect_timeout is None else max(self.reconnect_timeout - (time.monotonic() - t), .1)
+                    await asyncio.wait_for(self._open_rpc(addr), left)
+                    break
+                except Exception as e:
+                    logger.debug(f'Reconnect to {addr} failed: {e!r}')
+                    if self.reconnect_timeout is not None and time.monotonic() - t + delay > self.reconnect_timeout:
+                        self._rpc = _Offline('Connection lost')
+                        self._abandon()
+                        logger.error(f'Could not reconnect to {self._host} in {self.reconnect_timeout}s, giving up')
+                        return
+                    # the last address first, then the host name in case the device got a new one
+                    addr = self._host
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, max_delay)
+            self._resume()
+            logger.info(f'Reconnected to {self._host} in {time.monotonic()-t:.2f}s')
+
+    def _suspend(self):
+        # stop using the dead connection, return RPC futures to be resumed after reconnection
+        return ()
+
+    def _resume(self):
+        pass
+
+    def _abandon(self):
+        # reconnecting has failed, end what was to be resumed
+        pass
@@ -0,0 +1,228 @@
+"""
+Record the camera video stream as it is received, JPEG images are written to file without being decoded or re-encoded.
+
+Two formats are supported, by file extension:
+
+* `.avi` - MJPEG AVI, playable by most video players. A new file is started when it reaches :data:`Recorder.max_size`, or when the camera resolution changes
+* `.mjpeg`/`.mjpg` - concatenated JPEG images
+
+Receiving time of each frame is written to a `.csv` file next to the video file.
+
+.. note::
+
+    The camera of Cozmars is mounted upside down, so are the recorded videos. Most players can rotate them on playback, e.g. ``ffplay -vf hflip,vflip video.avi``
+"""
+import asyncio
+import struct
+from os import path
+from . import util
+from .util import logger
+
+def jpeg_size(data):
+    """:return: `(width, height)` of JPEG data, `None` if not found"""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xff:
+            return None
+        marker, length = data[i+1], int.from_bytes(data[i+2:i+4], 'big')
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            h, w = struct.unpack('>HH', data[i+5:i+9])
+            return w, h
+        i += 2 + length
+    return None
+
+class AviWriter:
+    """Minimal MJPEG AVI writer
+
+    :param file: path of the file
+    :type file: str
+    :param fps: frame rate in the header, it's updated with the actual frame rate on :meth:`close` if :meth:`write` is given timestamps
+    :type fps: float
+    """
+    def __init__(self, file, fps):
+        self._f = open(file, 'wb')
+        self._fps = fps
+        self._index = []
+        self._size = None
+        self._max_frame = 0
+        self._first = self._last = None
+
+    @property
+    def size(self):
+        """Bytes written"""
+        return self._f.tell()
+
+    @property
+    def frame_size(self):
+        """`(width, height)` of the frames, `None` before the first frame is written"""
+        return self._size
+
+    def write(self, jpeg, timestamp=None):
+        """Write a JPEG image as a frame"""
+        if self._size is None:
+            self._size = jpeg_size(jpeg) or (0, 0)
+            self._write_header()
+        if timestamp is not None:
+            self._first = self._first if self._first is not None else timestamp
+            self._last = timestamp
+        pad = len(jpeg) & 1
+        self._index.append((self._f.tell() - self._movi, len(jpeg)))
+        self._f.write(b'00dc' + struct.pack('<I', len(jpeg)) + jpeg + b'\0' * pad)
+        self._max_frame = max(self._max_frame, len(jpeg))
+
+    def _write_header(self):
+        w, h = self._size
+        # sizes, frame count and rate are filled in on close
+        self._f.write(b'RIFF\0\0\0\0AVI LIST' + struct.pack('<I', 192) + b'hdrl')
+        self._avih = self._f.tell()
+        self._f.write(b'avih' + struct.pack('<I', 56) + bytes(56))
+        self._f.write(b'LIST' + struct.pack('<I', 116) + b'strl')
+        self._strh = self._f.tell()
+        self._f.write(b'strh' + struct.pack('<I', 56) + bytes(56))
+        self._f.write(b'strf' + struct.pack('<IIiiHH4sIiiII', 40, 40, w, h, 1, 24, b'MJPG', w*h*3, 0, 0, 0, 0))
+        self._f.write(b'LIST\0\0\0\0')
+        self._movi = self._f.tell()
+        self._f.write(b'movi')
+
+    def close(self):
+        """Write the index and finish the file"""
+        if self._size is not None:
+            w, h = self._size
+            n = len(self._index)
+            fps = (n-1) / (self._last-self._first) if n > 1 and self._last > self._first else self._fps
+            end = self._f.tell()
+            self._f.write(b'idx1' + struct.pack('<I', 16*n))
+            self._f.write(b''.join(b'00dc' + struct.pack('<III', 0x10, offset, size) for offset, size in self._index))
+            riff = self._f.tell() - 8
+            self._f.seek(4)
+            self._f.write(struct.pack('<I', riff))
+            self._f.seek(self._avih + 8)
+            self._f.write(struct.pack('<IIIIIIIIII', round(1e6/fps), round(self._max_frame*fps), 0, 0x10, n, 0, 1, self._max_frame, w, h))
+            self._f.seek(self._strh + 8)
+            self._f.write(b'vidsMJPG' + struct.pack('<IHHIIIIIIiIhhhh', 0, 0, 0, 0, 1000, round(fps*1000), 0, n, self._max_frame, -1, 0, 0, 0, w, h))
+            self._f.seek(self._movi - 4)
+            self._f.write(struct.pack('<I', end - self._movi))
+        self._f.close()
+
+class MjpegWriter:
+    """Writes JPEG images one after another"""
+    def __init__(self, file, fps=None):
+        self._f = open(file, 'wb')
+
+    @property
+    def size(self):
+        """Bytes written"""
+        return self._f.tell()
+
+    def write(self, jpeg, timestamp=None):
+        """Write a JPEG image as a frame"""
+        self._f.write(jpeg)
+
+    def close(self):
+        """ """
+        self._f.close()
+
+class Recorder(util.withmixin):
+    """Camera video recorder, see :meth:`rcute_cozmars.camera.Camera.get_recorder`
+
+    :param camera: the camera
+    :param file: path of the video file
+    :type file: str
+    :param max_size: max size (bytes) of an AVI file, when reached a new file is started, named with a sequence number (`video.1.avi`, `video.2.avi`...). Default to 1GB
+    :type max_size: int
+    :param q_size: max number of frames waiting to be written, older frames are dropped when disk is too slow, default to 30
+    :type q_size: int
+    :param timestamps: whether to write receiving time of frames to a `.csv` file, default to `True`
+    :type timestamps: bool
+    """
+    def __init__(self, camera, file, max_size=2**30, q_size=30, timestamps=True):
+        self._camera = camera
+        self.file = file
+        """Path of the video file"""
+        self.max_size = max_size
+        self._q_size = q_size
+        self._timestamps = timestamps
+        self._task = None
+        self.frames = 0
+        """Number of frames written"""
+        self.files = []
+        """Paths of the video files written"""
+
+    @property
+    def _lo(self):
+        return self._camera._lo
+
+    @property
+    def _mode(self):
+        return self._camera._mode
+
+    def _in_event_loop(self):
+        return self._camera._in_event_loop()
+
+    @util.mode()
+    async def open(self):
+        """Start recording"""
+        if not self._task:
+            from concurrent.futures import ThreadPoolExecutor
+            self._buf = self._camera._output_stream(self._camera._multiplex_output_stream, maxsize=self._q_size, raw=True)
+            await self._buf.open()
+            # one thread, so that frames are written in order
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix='rcute-recorder')
+            self._task = asyncio.create_task(self._run())
+            self._camera._recorders.add(self)
+
+    @util.mode()
+    async def close(self):
+        """Stop recording, frames already received are written before the file is closed"""
+        if self._task:
+            await self._buf.close()
+            # the stream is detached, so queued frames are drained before the end mark;
+            # don't wait for room if writing has already failed
+            put = asyncio.ensure_future(self._buf.put(StopAsyncIteration()))
+            try:
+                await asyncio.wait([put, self._task], return_when=asyncio.FIRST_COMPLETED)
+                await self._task
+            finally:
+                put.cancel()
+                self._task = None
+                self._executor.shutdown(wait=False)
+                self._camera._recorders.discard(self)
+
+    async def _run(self):
+        lo = asyncio.get_running_loop()
+        writer = csv = None
+        try:
+            while True:
+                try:
+                    frame = await self._buf.read_frame()
+                except StopAsyncIteration:
+                    break
+                # an AVI file has a fixed frame size, start a new one if the camera is reconfigured
+                if not writer or isinstance(writer, AviWriter) and (self.max_size and writer.size >= self.max_size or jpeg_size(frame.jpeg) != writer.frame_size):
+                    writer and (await lo.run_in_executor(self._executor, self._close, writer, csv))
+                    writer, csv = await lo.run_in_executor(self._executor, self._new_file)
+                await lo.run_in_executor(self._executor, self._write, writer, csv, frame)
+                self.frames += 1
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            writer and (await lo.run_in_executor(self._executor, self._close, writer, csv))
+
+    def _new_file(self):
+        name, ext = path.splitext(self.file)
+        file = self.file if not self.files else f'{name}.{len(self.files)}{ext}'
+        writer = (AviWriter if ext.lower() == '.avi' else MjpegWriter)(file, self._camera.frame_rate)
+        csv = None
+        if self._timestamps:
+            csv = open(path.splitext(file)[0] + '.csv', 'w')
+            csv.write('frame,time\n')
+        self.files.append(file)
+        return writer, csv
+
+    def _write(self, writer, csv, frame):
+        writer.write(frame.jpeg, frame.received_at)
+        csv and csv.write(f'{self.frames},{frame.received_at:.6f}\n')
+
+    def _close(self, writer, csv):
+        writer.close()
+        csv and csv.close()
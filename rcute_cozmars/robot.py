@@ -7,6 +7,8 @@ There are three different modes to connect and control the robot:
 
 * :class:`AioRobot` works with asyncio, it executes commands asynchronously in async/await style.
 
+In :class:`Robot` and :class:`AsyncRobot`, commands accept a keyword argument ``nowait=True`` to return immediately without waiting for the result (fire-and-forget, errors are logged), which is cheaper in tight control loops where the result is not used.
+
 .. |Latest version on pypi| raw:: html
 
     <a href='https://pypi.org/project/rcute-cozmars-server' target='blank'>The latest version on pypi</a>
@@ -18,19 +20,17 @@ There are three different modes to connect and control the robot:
 """
 from platform import system
 import asyncio
-import aiohttp
-import websockets
 import threading
 import json
 import io
 import functools
 import wave
-from wsmprpc import RPCClient, RPCStream
-from . import util, env, screen, camera, microphone, touch_sensor, sonar, light, ir_sensor, lift, head, speaker, motor, eye_animation
+from wsmprpc import RPCStream
+from . import util, stats, reconnect, callback, env, screen, camera, microphone, touch_sensor, sonar, light, ir_sensor, lift, head, speaker, motor, eye_animation
 from .animation import animations
 from .util import logger
 
-class AioRobot:
+class AioRobot(stats.statsmixin, reconnect.reconnectmixin):
     """Async/await mode of Cozmars robot
 
     :param serial_or_ip: IP address or serial number of Cozmars to connect. Default to None, in which case the program will automatically detect the robot on connection if there's only one found.
@@ -39,8 +39,15 @@ class AioRobot:
     def __init__(self, serial_or_ip=None):
         if serial_or_ip:
             self._host = 'rcute-cozmars-' + serial_or_ip + '.local' if len(serial_or_ip) == 4 else serial_or_ip
+        stats.statsmixin.__init__(self)
+        reconnect.reconnectmixin.__init__(self)
         self._mode = 'aio'
         self._connected = False
+        self._session = None
+        self.http_timeout = 10
+        """Timeout (seconds) of HTTP requests to the robot, default to 10. Takes effect on next :meth:`connect`"""
+        self.http_limit = 4
+        """Max number of pooled HTTP connections to the robot, default to 4. Takes effect on next :meth:`connect`"""
         self._env = env.Env(self)
         self._screen = screen.Screen(self)
         self._camera = camera.Camera(self)
@@ -54,6 +61,8 @@ class AioRobot:
         self._lights = light.Lights(self)
         self._motors = motor.Motors(self)
         self._eye_anim = eye_animation.EyeAnimation(self)
+        self.callbacks = callback.CallbackDispatcher(self)
+        """Dispatcher running sensor event callbacks, see :class:`rcute_cozmars.callback.CallbackDispatcher`"""
         self.on_camera_image = None
         """Callback funciton. After :meth:`show_camera_view` is called, :data:`on_camera_image` will be called every time camera feed receives an new image. The callback must take the captured image as input and return processd image."""
 
@@ -71,6 +80,20 @@ class AioRobot:
         anim = getattr(anim, 'animate', anim)
         await anim(self, *args, **kwargs)
 
+    def batch(self):
+        """Collect commands issued in the `with` block and send them concurrently when the block exits, see :class:`rcute_cozmars.util.Batch`
+
+        .. code:: python
+
+            with robot.batch() as b:
+                robot.lights.color = 'red'
+                robot.head.angle = 10
+                robot.lift.height = .5
+                robot.motors.speed = (.5, .5)
+            print(b.results)
+        """
+        return util.Batch(self)
+
     @classmethod
     def get_animation_list(cl):
         """ """
@@ -145,76 +168,121 @@ class AioRobot:
         """ """
         if not self._connected:
             self._lo = asyncio.get_running_loop()
+            # what's on the screen is unknown, the first frame is sent in full
+            self._screen._frame = None
             if not hasattr(self, '_event_thread'):
                 self._event_thread = threading.current_thread()
             if not hasattr(self, '_host'):
-                found = await util.find_service('rcute-cozmars-????', '_ws._tcp.local.')
-                assert len(found)==1, f"More than one cozmars found {[a.server.split('-')[-1].split('.')[0] for a in found]}." if found else "No cozmars found."
-                self._host = found[0].server[:-1]
-            self._ws = await websockets.connect(f'ws://{self._host}/rpc')
-            if '-1' == await self._ws.recv():
-                raise RuntimeError('Could not connect to Cozmars, please close other programs that are already connected to Cozmars')
-            self._rpc = RPCClient(self._ws)
-            self._about = json.loads(await self._get('/about'))
-            await self._env.load()
+                self._host = await util.find_device('rcute-cozmars-????', 'cozmars')
+            await self._open_rpc(self._host)
+            self._session = util.http_session(self.http_timeout, self.http_limit)
+            try:
+                self._about = json.loads(await self._get('/about'))
+                util.cache_address(self._host, self._about['ip'])
+                await self._env.load()
+            except BaseException:
+                await self._close_session()
+                await self._ws.close()
+                raise
             self._eye_anim_task = asyncio.create_task(self._eye_anim.animate(self))
+            self._event_rpc = self._rpc.sensor_data()
             self._event_task = asyncio.create_task(self._get_event())
+            self._watch_task = asyncio.create_task(self._watch_connection())
             self._connected = True
 
+    _ws_url = 'ws://{}/rpc'
+    _busy_error = 'Could not connect to Cozmars, please close other programs that are already connected to Cozmars'
+
+    def _suspend(self):
+        self._event_task.cancel()
+        streams = [c for c in (self._camera, self._microphone) if not c.closed]
+        # the speaker is resumed only while playing, not when it's waiting for the end of a stream
+        streams += [self._speaker] if not self._speaker.closed and self._speaker._lock.locked() else []
+        self._resuming = streams
+        return [self._event_rpc] + [c._stream_rpc for c in streams]
+
+    def _resume(self):
+        self._event_rpc = self._rpc.sensor_data()
+        self._event_task = asyncio.create_task(self._get_event())
+        for c in self._resuming:
+            c._stream_rpc = c._get_rpc()
+            c._stream_rpc.request()
+        self._resuming = []
+        # the screen may have been reset while offline
+        self._screen._frame = None
+        if self._eye_anim_task.done():
+            self._eye_anim_task = asyncio.create_task(self._eye_anim.animate(self))
+
+    def _abandon(self):
+        # readers of camera/microphone buffers get the error instead of waiting forever
+        err = ConnectionError('Connection lost')
+        for c in self._resuming:
+            getattr(c, '_multiplex_output_stream', None) and c._multiplex_output_stream.force_put_nowait(err)
+        self._resuming = []
+
     @property
     def connected(self):
         """ """
         return self._connected
 
-    async def _call_callback(self, cb, *args):
-        if cb:
-            if self._mode == 'aio':
-                (await cb(*args)) if asyncio.iscoroutinefunction(cb) else cb(*args)
-            else:
-                self._lo.run_in_executor(None, cb, *args)
-
     async def _get_event(self):
-        self._event_rpc = self._rpc.sensor_data()
+        cb = self.callbacks.dispatch
         async for event, data in self._event_rpc:
             try:
                 if event == 'pressed':
                     if not data:
                         self.touch_sensor._long_touched = self.touch_sensor._double_touched = False
                     self.touch_sensor._touched = data
-                    await self._call_callback(self.touch_sensor.when_touched if data else self.touch_sensor.when_released)
+                    cb('touch', self.touch_sensor.when_touched if data else self.touch_sensor.when_released)
                 elif event == 'long_pressed':
                     self.touch_sensor._long_touched = data
-                    await self._call_callback(self.touch_sensor.when_long_touched)
+                    cb('touch', self.touch_sensor.when_long_touched)
                 elif event == 'double_pressed':
                     self.touch_sensor._touched = data
                     self.touch_sensor._double_touched = data
-                    await self._call_callback(self.touch_sensor.when_touched)
-                    await self._call_callback(self.touch_sensor.when_double_touched)
+                    cb('touch', self.touch_sensor.when_touched)
+                    cb('touch', self.touch_sensor.when_double_touched)
                 elif event == 'out_of_range':
-                    await self._call_callback(self.sonar.when_out_of_range, data)
+                    cb('sonar', self.sonar.when_out_of_range, data)
                 elif event == 'in_range':
-                    await self._call_callback(self.sonar.when_in_range, data)
-                elif event == 'lir':
-                    self._ir_sensors._state[0] = data
-                    await self._call_callback(self._ir_sensors.when_state_changed, self._ir_sensors._state)
-                elif event == 'rir':
-                    self._ir_sensors._state[2] = data
-                    await self._call_callback(self._ir_sensors.when_state_changed, self._ir_sensors._state)
-                elif event == 'mir':
-                    self._ir_sensors._state[1] = data
-                    await self._call_callback(self._ir_sensors.when_state_changed, self._ir_sensors._state)
+                    cb('sonar', self.sonar.when_in_range, data)
+                elif event in ('lir', 'mir', 'rir'):
+                    self._ir_sensors._state[('lir', 'mir', 'rir').index(event)] = data
+                    # only the latest state matters
+                    cb('ir', self._ir_sensors.when_state_changed, self._ir_sensors._state, coalesce=True)
             except Exception as e:
                 logger.exception(e)
 
+    def _extra_stats(self, reset):
+        s = {'callbacks': self.callbacks.summary(), 'camera': self.camera._stats(reset)}
+        reset and self.callbacks.reset()
+        return s
+
     async def disconnect(self):
         """ """
         if self._connected:
+            self._watch_task.cancel()
             self._event_task.cancel()
             self._eye_anim_task.cancel()
+            self._stats_task and self._stats_task.cancel()
+            # the adaptive controller is stopped, set it again after reconnecting
+            adaptive, self.camera._adaptive, self.camera._adaptive_task = self.camera._adaptive_task, None, None
+            adaptive and adaptive.cancel()
             self._event_rpc.cancel()
-            await asyncio.gather(self.when_called(None), self.close_camera_view(), return_exceptions=True)
+            self.callbacks.close()
+            closing = [self.when_called(None), self.close_camera_view()]
+            adaptive and closing.append(adaptive)
+            self._screen._compositor and closing.append(self._screen._compositor.close())
+            # recorders write the frames received so far and close their files
+            closing += [r.close() for r in list(self.camera._recorders)]
+            await asyncio.gather(*closing, return_exceptions=True)
             await asyncio.gather(self.camera.close(), self.microphone.close(), self.speaker.close(), return_exceptions=True)
+            # decoding threads are created again on first use after reconnecting
+            self.camera._executor and self.camera._executor.shutdown(wait=False)
+            self.camera._executor = None
             await self._ws.close()
+            await self._close_session()
+            self._screen._frame = None
             self._connected = False
 
     async def __aenter__(self):
@@ -350,8 +418,30 @@ class AioRobot:
         return await self._lo.run_in_executor(None, stt_run)
 
     @util.mode()
-    async def show_camera_view(self):
-        """Open camera and run a background thread showing the camera view or processed camera images if :data:`on_camera_image` is set"""
+    async def show_camera_view(self, http=False, **options):
+        """Open camera and run a background thread showing the camera view or processed camera images if :data:`on_camera_image` is set
+
+        :param http: if `True`, serve the view over HTTP instead of showing it in a window, which works without a desktop GUI and for any number of browser viewers, default to `False`.
+            Images are only decoded and re-encoded for viewers if :data:`on_camera_image` is set when this is called, otherwise they are forwarded as received from the robot
+        :type http: bool
+        :param options: options of :class:`rcute_cozmars.preview.PreviewServer` in HTTP mode, e.g. `port`, `host` and `max_viewers`
+        :return: the :class:`rcute_cozmars.preview.PreviewServer` in HTTP mode, see its `url`
+        """
+        if http:
+            process = None
+            if self.on_camera_image:
+                def process(im):
+                    # the image is shared with other camera buffers
+                    im = im.copy()
+                    res = self.on_camera_image(im)
+                    return im if res is None else res
+            self._preview = self.camera.get_preview_server(process=process, **options)
+            await self._preview.open()
+            # the camera keeps streaming for latest_camera_view, which is decoded only when it's read
+            self._cam_view_buf = self.camera.get_buffer(raw=True)
+            await self._cam_view_buf.open()
+            self._cam_view_task = asyncio.create_task(self._track_camera_view(self._cam_view_buf))
+            return self._preview
         def cam_run():
             import cv2
             self._stop_cam_view = False
@@ -367,15 +457,29 @@ class AioRobot:
         self._cam_view_thread = threading.Thread(target=cam_run, daemon=True)
         self._cam_view_thread.start()
 
+    async def _track_camera_view(self, buf):
+        while True:
+            self._latest_camera_frame = await buf.read_frame()
+
     @property
     def latest_camera_view(self):
         """latest image from :meth:`show_camera_view` """
+        frame = getattr(self, '_latest_camera_frame', None)
+        if frame:
+            self._latest_camera_view, self._latest_camera_frame = frame._decode(True, False, 1), None
         return getattr(self, '_latest_camera_view', None)
 
     @util.mode()
     async def close_camera_view(self):
-        """Stop the background thread created in :meth:`show_camera_view`"""
+        """Stop the background thread or HTTP server created in :meth:`show_camera_view`"""
         self._stop_cam_view = True
+        getattr(self, '_preview', None) and (await self._preview.close())
+        self._preview = None
+        if getattr(self, '_cam_view_task', None):
+            self._cam_view_task.cancel()
+            await asyncio.gather(self._cam_view_task, return_exceptions=True)
+            await self._cam_view_buf.close()
+            self._cam_view_task = None
         hasattr(self, '_cam_view_thread') and self._cam_view_thread.is_alive() and await self._lo.run_in_executor(None, self._cam_view_thread.join)
 
     @property
@@ -426,10 +530,17 @@ class AioRobot:
         finally:
             self._connected = False
 
+    async def _close_session(self):
+        session, self._session = self._session, None
+        session and (await session.close())
+
     async def _get(self, sub_url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get('http://' + self._host + sub_url) as resp:
-                return await resp.text()
+        url = 'http://' + self._addr + sub_url
+        if self._session:
+            return await util.http_get(self._session, url)
+        # after disconnect, e.g. poweroff/reboot
+        async with util.http_session(self.http_timeout, self.http_limit) as session:
+            return await util.http_get(session, url)
 
 class Robot(AioRobot):
     """Cozmars robot synchronization mode
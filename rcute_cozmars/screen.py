@@ -1,14 +1,32 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
 from . import util
 from . import led
 import numpy as np
-import cv2
-from PIL import Image, ImageFont, ImageDraw
 
 class Screen(led.LED):
     """ """
 
     def __init__(self, robot):
         led.LED.__init__(self, robot)
+        self._frame = None
+        self.diff = True
+        """Whether :meth:`display` sends only the regions that changed since the last frame, default to `True`"""
+        self.tile_size = 8
+        """Size (pixels) of the tiles in which changes are detected, default to 8"""
+        self.max_rects = 8
+        """Max number of rectangles to send for a frame, more changed regions are merged into their bounding box, default to 8"""
+        self.full_frame_ratio = .5
+        """When the changed regions cover more than this ratio of the screen, the full frame is sent, default to 0.5"""
+        self.font_cache_size = 4
+        """Max number of fonts (of a file and size) kept loaded by :meth:`text`, default to 4"""
+        self.text_cache_size = 2**22
+        """Max bytes of text images rendered by :meth:`text` kept for reuse, default to 4MB. Set to 0 to disable"""
+        self._fonts = _LRUCache()
+        self._texts = _LRUCache()
+        self._compositor = None
 
     def _light_rpc(self):
         return self._rpc.backlight
@@ -18,6 +36,22 @@ class Screen(led.LED):
         """ `(240, 135)`, read-only """
         return 240, 135
 
+    @property
+    def compositor(self):
+        """:class:`rcute_cozmars.compositor.Compositor` composing the screen from layers, including the eyes
+
+        While it's open, draw on its layers instead of calling :meth:`display`, :meth:`fill` or :meth:`text`, which draw on the screen directly
+
+        .. code:: python
+
+            with robot.screen.compositor as comp:
+                comp.layer('text').text('42%', x=190, y=5, size=20)
+        """
+        if not self._compositor:
+            from .compositor import Compositor
+            self._compositor = Compositor(self)
+        return self._compositor
+
     @util.mode()
     async def fill(self, color, x=0, y=0, w=240, h=135, stop_eyes=True):
         """Fill the screen in block
@@ -34,10 +68,14 @@ class Screen(led.LED):
         :type h: int
         :raises ValueError: throw an exception when the filled area exceeds the screen area
         """
-        if not self._in_range((x, y), (w, h)):
+        if not self._in_range(x, y, w, h):
             raise ValueError(f'Fill area must not exceed dimensions of screen {self.resolution}')
-        x, y = y, 240-x-w
         stop_eyes and (await self._robot.eyes.stop())
+        if (x, y, w, h) == (0, 0, *self.resolution):
+            self._frame = np.full((h, w, 3), util.bgr(color), np.uint8)
+        elif self._frame is not None:
+            self._frame[y:y+h, x:x+w] = util.bgr(color)
+        x, y = y, 240-x-w
         await self._rpc.fill(bgr_to_color565(util.bgr(color)), x, y, h, w)
 
     @util.mode()
@@ -52,8 +90,10 @@ class Screen(led.LED):
         :type color: str/tuple
         :raises ValueError: An exception is thrown when the coordinates exceed the screen area
         """
-        if not self._in_range((x, y)):
+        if not self._in_range(x, y):
             raise ValueError(f'Pixel must not exceed dimensions of screen {self.resolution}')
+        if self._frame is not None:
+            self._frame[y, x] = util.bgr(color)
         x, y = y, 240-x-1
         await self._rpc.pixel(x, y, bgr_to_color565(util.bgr(color)))
 
@@ -64,7 +104,9 @@ class Screen(led.LED):
         raises AssertionError: raise error when the area to display exceeds screen
         """
         h, w = image.shape[:2]
-        assert self._in_range((x, y), (x+w-1, y+h-1)), 'Display area must not exceed dimensions of screen {self.resolution}'
+        assert self._in_range(x, y, w, h), f'Display area must not exceed dimensions of screen {self.resolution}'
+        if self._frame is not None:
+            self._frame[y:y+h, x:x+w] = image
         x, y = y, 240-x-w
         await self._rpc.display(image_to_data(np.rot90(image)), x, y, x+h-1, y+w-1)
 
@@ -72,12 +114,14 @@ class Screen(led.LED):
     async def display(self, image, fill_type='stretch', stop_eyes=True):
         """Display image on screen
 
+        If :data:`diff` is `True`, the image is compared with the last frame on screen, and only the changed regions are sent.
+
         :param image: BGR image to be displayed. The image will be resized to fit the screen,
         :type image: PIL.Image/numpy.ndarray
         :param fill_type: must be one of 'stretch'/'crop'/'adapt', default to 'stretch'
         :type fill_type: str, optional
         """
-        if isinstance(image, Image.Image):
+        if not isinstance(image, np.ndarray): # PIL.Image
             image = np.array(image)
         x, y, image = self._resize_to_screen(image, fill_type)
         W, H = self.resolution
@@ -85,7 +129,113 @@ class Screen(led.LED):
         h, w = image.shape[:2]
         filled_img[y: y+h, x: x+w] = image
         stop_eyes and (await self._robot.eyes._set_exp('stopped', True))
-        await self._rpc.display(image_to_data(np.rot90(filled_img)), 0, 0, H-1, W-1)
+        await self._update(filled_img)
+
+    async def _update(self, frame, data=None):
+        # send a full frame, or only the regions that differ from the last one. `data` is the converted full frame if available
+        rects = None
+        if self.diff and self._frame is not None:
+            rects = dirty_rects(self._frame, frame, self.tile_size, self.max_rects)
+            if sum(w*h for x, y, w, h in rects) > self.full_frame_ratio * frame.shape[0] * frame.shape[1]:
+                rects = None
+        self._frame = frame
+        try:
+            if rects is None:
+                W, H = self.resolution
+                await self._rpc.display(data or image_to_data(np.rot90(frame)), 0, 0, H-1, W-1)
+            else:
+                # the regions don't overlap, so they can be sent concurrently
+                await asyncio.gather(*(self._display_rect(frame, *r) for r in rects))
+        except BaseException:
+            # the screen may show part of the frame, send the next one in full
+            self._frame = None
+            raise
+
+    async def _display_rect(self, frame, x, y, w, h):
+        x0, y0 = y, 240-x-w
+        await self._rpc.display(image_to_data(np.rot90(frame[y:y+h, x:x+w])), x0, y0, x0+h-1, y0+w-1)
+
+    @util.mode()
+    async def play(self, src, fps=None, fill_type='stretch', repeat=1, q_size=10, stop_eyes=True):
+        """Play a video or animated GIF on screen
+
+        Frames are decoded, resized and converted for the screen ahead of time in a background thread, and sent at the clip's pace. Frames that are late by more than a frame interval, because the connection can't keep up, are dropped to keep the pace.
+
+        :param src: video file, GIF file, or a list of images
+        :type src: str/list
+        :param fps: max frame rate, source frames are skipped to keep the clip's speed. Default to `None` for the clip's own frame rate, or 10 for a list of images
+        :type fps: float, optional
+        :param fill_type: see :meth:`display`, default to 'stretch'
+        :type fill_type: str, optional
+        :param repeat: play times, default is 1
+        :type repeat: int, optional
+        :param q_size: max number of frames converted ahead of time, default to 10
+        :type q_size: int, optional
+        :return: dict of the numbers of frames shown and dropped
+        """
+        lo = asyncio.get_running_loop()
+        q = asyncio.Queue()
+        # the semaphore bounds the queue, so that the thread blocks instead of converting the whole clip
+        slots = threading.Semaphore(q_size)
+        stop = threading.Event()
+        def put(item):
+            # return False if playing has stopped
+            while not slots.acquire(timeout=.1):
+                if stop.is_set():
+                    return False
+            lo.call_soon_threadsafe(q.put_nowait, item)
+            return True
+        def convert():
+            try:
+                for _ in range(repeat):
+                    if not self._convert_frames(src, fps, fill_type, put):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+        threading.Thread(target=convert, daemon=True).start()
+        stop_eyes and (await self._robot.eyes._set_exp('stopped', True))
+        W, H = self.resolution
+        shown = dropped = 0
+        start = None
+        try:
+            while True:
+                item = await q.get()
+                slots.release()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                pts, duration, data, frame = item
+                if pts == 0:
+                    # each round is timed from its first frame
+                    start = time.monotonic()
+                delay = start + pts - time.monotonic()
+                if delay < -duration:
+                    dropped += 1
+                    continue
+                delay > 0 and (await asyncio.sleep(delay))
+                self._frame = frame
+                await self._rpc.display(data, 0, 0, H-1, W-1)
+                shown += 1
+        finally:
+            stop.set()
+        return {'frames': shown, 'dropped': dropped}
+
+    def _convert_frames(self, src, fps, fill_type, put):
+        W, H = self.resolution
+        next_pts = 0
+        for pts, duration, image in _read_frames(src, fps):
+            if fps and pts < next_pts - 1e-6:
+                continue
+            next_pts = pts + 1/fps if fps else pts
+            x, y, image = self._resize_to_screen(image, fill_type)
+            frame = np.zeros((H, W, 3), np.uint8)
+            h, w = image.shape[:2]
+            frame[y: y+h, x: x+w] = image
+            if not put((pts, max(duration, 1/fps if fps else 0), image_to_data(np.rot90(frame)), frame)):
+                return False
+        return True
 
     @util.mode()
     async def text(self, text, size=35, color='cyan', bg_color='black', font=None, stop_eyes=True):
@@ -104,19 +254,44 @@ class Screen(led.LED):
         """
         if not text:
             return
-        font = ImageFont.truetype(font or util.resource('msyh.ttc'), size)
-        image = Image.new("RGB", self.resolution, util.bgr(bg_color))
+        color, bg_color, font = tuple(util.bgr(color)), tuple(util.bgr(bg_color)), font or util.resource('msyh.ttc')
+        key = text, size, color, bg_color, font
+        # the rendered image and its converted data are reused for the same text
+        frame, data = self._texts.get(key) or (None, None)
+        if frame is None:
+            frame = self._render_text(text, size, color, bg_color, font)
+            data = image_to_data(np.rot90(frame))
+            self._texts.put(key, (frame, data), frame.nbytes + len(data), self.text_cache_size)
+        stop_eyes and (await self._robot.eyes._set_exp('stopped', True))
+        # the framebuffer is modified in place by other drawing methods, so it gets a copy
+        await self._update(frame.copy(), data)
+
+    def _font(self, font_file, size):
+        from PIL import ImageFont
+        font = self._fonts.get((font_file, size))
+        if font is None:
+            # loading a font parses the whole file, which is several MB for the default one
+            font = ImageFont.truetype(font_file, size)
+            self._fonts.put((font_file, size), font, 1, self.font_cache_size)
+        return font
+
+    def _render_text(self, text, size, color, bg_color, font_file):
+        from PIL import Image, ImageDraw
+        font = self._font(font_file, size)
+        image = Image.new("RGB", self.resolution, bg_color)
         draw = ImageDraw.Draw(image)
-        location = tuple((a-b)/2 for a, b in zip(self.resolution, font.getsize(text)))
-        draw.text(location, text, fill=util.bgr(color), font=font)
+        l, t, r, b = text_bbox(font, text)
+        location = tuple((a-b)/2 - o for a, b, o in zip(self.resolution, (r-l, b-t), (l, t)))
+        draw.text(location, text, fill=color, font=font)
         # W, H = self.resolution
         # image = np.zeros((H, W, 3), np.uint8)
         # image = cv2.putText(image, text, ((W-20*len(text))//2, 75), cv2.FONT_HERSHEY_SIMPLEX, 1.5, util.bgr(color), 2)
-        return await self.display(np.array(image), stop_eyes=stop_eyes)
+        return np.array(image)
 
     _fill_types = ['stretch', 'crop', 'adapt']
     def _resize_to_screen(self, img, fill_type):
         assert fill_type in self._fill_types, f'fill_type {fill_type} must be one of {self._fill_types}'
+        import cv2
         h, w = img.shape[:2]
         W, H = self.resolution
         if fill_type == 'adapt':
@@ -137,12 +312,10 @@ class Screen(led.LED):
                 return 0, 0, cv2.resize(img[:,b:w-b], self.resolution)
 
 
-    def _in_range(self, *points):
-        w, h = self.resolution
-        for p in points:
-            if 0>p[0]>w or 0>p[1]>h:
-                return False
-        return True
+    def _in_range(self, x, y, w=1, h=1):
+        # whether the rectangle is inside the screen
+        W, H = self.resolution
+        return 0 <= x and 0 <= y and w > 0 and h > 0 and x+w <= W and y+h <= H
 
 
 def bgr_to_color565(b, g=0, r=0):
@@ -152,12 +325,112 @@ def bgr_to_color565(b, g=0, r=0):
         pass
     return (r & 0xF8) << 8 | (g & 0xFC) << 3 | b >> 3
 
+def text_bbox(font, text):
+    """:return: `(left, top, right, bottom)` of `text` drawn at (0, 0) with a PIL font"""
+    if hasattr(font, 'getbbox'): # Pillow >= 8, getsize() is removed in Pillow 10
+        return font.getbbox(text)
+    return (0, 0, *font.getsize(text))
+
+class _LRUCache(OrderedDict):
+    # least recently used items are evicted when the total size of the items exceeds the limit
+    def __init__(self):
+        OrderedDict.__init__(self)
+        self._size = 0
+
+    def get(self, key):
+        item = OrderedDict.get(self, key)
+        if item is None:
+            return None
+        self.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, size, limit):
+        if key in self:
+            self._size -= self.pop(key)[1]
+        if size <= limit:
+            self[key] = value, size
+            self._size += size
+        while self._size > limit:
+            self._size -= self.popitem(last=False)[1][1]
+
+def _read_frames(src, fps):
+    # yield (presentation time, duration, BGR image) of the frames of a video/GIF file or a list of images
+    if isinstance(src, str) and src.lower().endswith('.gif'):
+        from PIL import Image, ImageSequence
+        pts = 0
+        with Image.open(src) as gif:
+            for frame in ImageSequence.Iterator(gif):
+                duration = frame.info.get('duration', 100) / 1000
+                yield pts, duration, np.array(frame.convert('RGB'))[:, :, ::-1]
+                pts += duration
+    elif isinstance(src, str):
+        import cv2
+        cap = cv2.VideoCapture(src)
+        if not cap.isOpened():
+            raise IOError(f'Unable to open {src}')
+        try:
+            duration = 1 / (cap.get(cv2.CAP_PROP_FPS) or 25)
+            i = 0
+            while True:
+                ok, image = cap.read()
+                if not ok:
+                    break
+                yield i * duration, duration, image
+                i += 1
+        finally:
+            cap.release()
+    else:
+        duration = 1 / (fps or 10)
+        for i, image in enumerate(src):
+            yield i * duration, duration, image if isinstance(image, np.ndarray) else np.array(image)
+
+# bits of BGR kept in RGB565
+_MASK_565 = np.array((0xF8, 0xFC, 0xF8), np.uint8)
+
+def dirty_rects(old, new, tile=8, max_rects=8):
+    """:return: list of `(x, y, w, h)` rectangles covering the pixels that differ between two BGR images of the same size on the screen.
+        Differences lost in RGB565 conversion are ignored. More than `max_rects` rectangles are merged into their bounding box
+    """
+    changed = ((old ^ new) & _MASK_565).any(axis=2)
+    h, w = changed.shape
+    th, tw = -(-h // tile), -(-w // tile)
+    grid = np.zeros((th * tile, tw * tile), bool)
+    grid[:h, :w] = changed
+    grid = grid.reshape(th, tile, tw, tile).any(axis=(1, 3))
+    # runs of changed tiles in each row, merged with the rectangle above if it spans the same columns
+    rects, above = [], {}
+    for ty in range(th):
+        row = np.flatnonzero(np.diff(np.concatenate(([0], grid[ty].view(np.int8), [0]))))
+        runs = {}
+        for x0, x1 in zip(row[::2], row[1::2]):
+            r = above.get((x0, x1))
+            if r:
+                r[3] += 1
+            else:
+                r = [x0, ty, x1-x0, 1]
+                rects.append(r)
+            runs[(x0, x1)] = r
+        above = runs
+    if len(rects) > max_rects:
+        (x0, y0), (x1, y1) = np.min([r[:2] for r in rects], axis=0), np.max([(r[0]+r[2], r[1]+r[3]) for r in rects], axis=0)
+        rects = [[x0, y0, x1-x0, y1-y0]]
+    res = []
+    for tx, ty, tw, th in rects:
+        # shrink to the changed pixels
+        x, y = tx * tile, ty * tile
+        sub = changed[y: y + th*tile, x: x + tw*tile]
+        cols, rows = np.flatnonzero(sub.any(axis=0)), np.flatnonzero(sub.any(axis=1))
+        res.append((int(x + cols[0]), int(y + rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)))
+    return res
+
 def image_to_data(bgr_image):
-    bgr_image = bgr_image.astype('uint16')
-    # data = numpy.array(image.convert("RGB")).astype("uint16")
-    color = (
-    ((bgr_image[:, :, 2] & 0xF8) << 8)
-    | ((bgr_image[:, :, 1] & 0xFC) << 3)
-    | (bgr_image[:, :, 0] >> 3)
-    )
-    return np.dstack(((color >> 8) & 0xFF, color & 0xFF)).flatten().tolist()
\ No newline at end of file
+    """:return: big-endian RGB565 data of a BGR image, as `bytes`"""
+    # the two bytes of each pixel are computed separately in uint8, without a uint16 copy of the image:
+    # RRRRRGGG GGGBBBBB
+    b, g, r = bgr_image[:, :, 0], bgr_image[:, :, 1], bgr_image[:, :, 2]
+    data = np.empty(bgr_image.shape[:2] + (2,), np.uint8)
+    np.bitwise_and(r, 0xF8, out=data[:, :, 0])
+    data[:, :, 0] |= g >> 5
+    np.left_shift(g & 0x1C, 3, out=data[:, :, 1])
+    data[:, :, 1] |= b >> 3
+    return data.tobytes()
@@ -4,10 +4,6 @@ from .sound_mixin import soundmixin
 import numpy as np
 from collections.abc import Iterable
 from inspect import isasyncgen
-from pydub import AudioSegment
-from pydub.generators import Sine
-import librosa
-from pydub.playback import play
 
 import warnings
 warnings.filterwarnings('ignore', message='PySoundFile failed. Trying audioread instead.') # librosa
@@ -117,6 +113,8 @@ def max_freq(tones):
     return functools.reduce(lambda r,e: max(r, max_freq(e) if isinstance(e, (list, tuple)) else util.freq(e)), tones, 0)
 
 def tone2audio(tones, base_beat_ms, fade, sr):
+    from pydub import AudioSegment
+    from pydub.generators import Sine
     fade *= base_beat_ms
     return functools.reduce(lambda r,e: r+(tone2audio(e, base_beat_ms/2, fade, sr) if isinstance(e, (list, tuple)) else \
             (Sine(util.freq(e), sample_rate=sr).to_audio_segment(duration=base_beat_ms).append(AudioSegment.silent(duration=fade, frame_rate=sr), crossfade=fade)) if e else AudioSegment.silent(duration=base_beat_ms, frame_rate=sr)), \
@@ -141,6 +139,7 @@ def file_sr_bs_gen(src, sr, dt, block_duration):
     except (AssertionError, RuntimeError):
         # librosa supports more formats than soundfile
         # down-sample if needed
+        import librosa
         if librosa.get_samplerate(src) < sr:
             sr = None
         y, sr = librosa.load(src, sr=sr, mono=True, res_type='kaiser_fast')
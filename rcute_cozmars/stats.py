@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import deque
+from wsmprpc import RPCClient
+from . import util
+from .util import logger
+
+_REQUEST = 0
+
+def _cancelled(fut):
+    # cancelled by the client, e.g. a closed stream, or by the server: servers on Python < 3.8 send CancelledError as an error
+    if fut.cancelled():
+        return True
+    e = fut.exception()
+    return e is not None and str(e) == 'CancelledError'
+
+def _msg_header(data):
+    # msgtype and msgid of a msgpack encoded (msgtype, msgid, ...) message, without unpacking the payload
+    try:
+        b = data[2]
+        if b < 0x80:
+            msgid = b
+        elif b == 0xcc:
+            msgid = data[3]
+        elif b == 0xcd:
+            msgid = int.from_bytes(data[3:5], 'big')
+        else:
+            msgid = int.from_bytes(data[3:7], 'big')
+        return data[1], msgid
+    except (IndexError, TypeError):
+        return None, None
+
+class _MethodStats:
+    def __init__(self, window):
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+        self.reset()
+
+    def reset(self):
+        self.calls = self.errors = self.cancelled = 0
+        self.rx_bytes = self.rx_msgs = self.tx_bytes = self.tx_msgs = 0
+        self.latencies.clear()
+
+    def summary(self, elapsed):
+        lat = sorted(self.latencies)
+        pct = lambda q: lat[min(len(lat)-1, int(q*len(lat)))] if lat else None
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'in_flight': self.in_flight,
+            'latency': {'p50': pct(.5), 'p95': pct(.95), 'p99': pct(.99), 'max': lat[-1] if lat else None},
+            'rx_bytes_per_sec': self.rx_bytes / elapsed,
+            'rx_msgs_per_sec': self.rx_msgs / elapsed,
+            'tx_bytes_per_sec': self.tx_bytes / elapsed,
+            'tx_msgs_per_sec': self.tx_msgs / elapsed,
+        }
+
+class RPCStats:
+    """Per-method call counts, latencies (seconds) and stream bandwidth of an RPC connection
+
+    Latencies of the last :data:`window` calls of each method are kept to calculate the percentiles.
+    Calls which send or receive streams (camera, microphone, speaker...) are counted in bandwidth, but not in latency.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self._methods = {}
+        self._msgids = {}
+        self._since = time.monotonic()
+
+    def reset(self):
+        """Reset counters, in-flight calls are kept"""
+        self._since = time.monotonic()
+        for m in self._methods.values():
+            m.reset()
+
+    def _start(self, msgid, method, fut):
+        m = self._methods.get(method)
+        if not m:
+            m = self._methods[method] = _MethodStats(self.window)
+        m.calls += 1
+        m.in_flight += 1
+        self._msgids[msgid] = m, None, False
+        fut.add_done_callback(lambda f: self._done(msgid, f))
+
+    def _done(self, msgid, fut):
+        m, t, streamed = self._msgids.pop(msgid, (None, None, None))
+        if m:
+            m.in_flight -= 1
+            if _cancelled(fut):
+                m.cancelled += 1
+            elif fut.exception():
+                m.errors += 1
+            elif t is not None and not streamed:
+                m.latencies.append(time.monotonic() - t)
+
+    def _sent(self, data):
+        msgtype, msgid = _msg_header(data)
+        m, t, streamed = self._msgids.get(msgid, (None, None, None))
+        if m:
+            m.tx_bytes += len(data)
+            m.tx_msgs += 1
+            if msgtype == _REQUEST:
+                self._msgids[msgid] = m, time.monotonic(), streamed
+            else:
+                self._msgids[msgid] = m, t, True
+
+    def _received(self, data):
+        msgtype, msgid = _msg_header(data)
+        m, t, streamed = self._msgids.get(msgid, (None, None, None))
+        if m:
+            m.rx_bytes += len(data)
+            m.rx_msgs += 1
+            if msgtype != 1: # stream chunk/end, not a plain response
+                self._msgids[msgid] = m, t, True
+
+    def summary(self):
+        """:return: dict of statistics of each RPC method since last reset"""
+        elapsed = max(time.monotonic() - self._since, 1e-6)
+        return {'elapsed': elapsed, 'rpc': {k: m.summary(elapsed) for k, m in self._methods.items()}}
+
+class _CountingWebSocket:
+    def __init__(self, ws, stats):
+        self._ws = ws
+        self._stats = stats
+
+    async def __aiter__(self):
+        async for data in self._ws:
+            self._stats._received(data)
+            yield data
+
+    async def send(self, data):
+        self._stats._sent(data)
+        await self._ws.send(data)
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+class StatsRPCClient(RPCClient):
+    """:class:`wsmprpc.RPCClient` that records :class:`RPCStats`"""
+    def __init__(self, ws, stats):
+        self.stats = stats
+        RPCClient.__init__(self, _CountingWebSocket(ws, stats))
+
+    def _request(self, method, *args, **kwargs):
+        fut = RPCClient._request(self, method, *args, **kwargs)
+        self.stats._start(fut._msgid, method, fut)
+        return fut
+
+class statsmixin:
+    """ """
+    def __init__(self):
+        self._stats = RPCStats()
+        self._stats_task = None
+        self.collect_stats = False
+        """Whether to collect RPC statistics, default to `False`. Must be set before :meth:`connect`, see :meth:`stats`"""
+
+    def _rpc_client(self, ws):
+        return StatsRPCClient(ws, self._stats) if self.collect_stats else RPCClient(ws)
+
+    @util.mode()
+    async def stats(self, reset=False):
+        """Statistics of RPC calls since last reset, only available when :data:`collect_stats` is `True`
+
+        For each RPC method: call count, errors, cancelled calls (not counted as errors), in-flight calls, latency percentiles (p50/p95/p99/max, in seconds),
+        and bytes/messages per second received and sent (e.g. for the camera, microphone and speaker streams).
+
+        :param reset: reset the statistics after reading, default to `False`
+        :type reset: bool
+        :rtype: dict
+        """
+        s = self._stats.summary()
+        for k, v in self._extra_stats(reset).items():
+            s[k] = v
+        reset and self._stats.reset()
+        return s
+
+    def _extra_stats(self, reset):
+        # statistics of other parts of the device, to be merged into `stats()`
+        return {}
+
+    @util.mode()
+    async def log_stats(self, interval=60, callback=None):
+        """Periodically report :meth:`stats`, which is reset on each report
+
+        :param interval: seconds between reports, default to 60. If set to `None`, periodic report stops
+        :type interval: float
+        :param callback: function to receive the stats dict, default to `None`, in which case the stats is logged
+        :type callback: callable, optional
+        """
+        self._stats_task and self._stats_task.cancel()
+        self._stats_task = None
+        if interval:
+            async def report():
+                while True:
+                    await asyncio.sleep(interval)
+                    s = await self.stats(reset=True)
+                    try:
+                        callback(s) if callback else logger.info(f'{self.__class__.__name__} stats: {s}')
+                    except Exception as e:
+                        logger.exception(e)
+            self._stats_task = asyncio.create_task(report())
@@ -1,14 +1,18 @@
 import functools
 import asyncio
+import contextvars
+import threading
 from concurrent import futures
 from wsmprpc import RPCStream
-from PIL import ImageColor
 from os import path
-import librosa
-from zeroconf import ServiceBrowser, Zeroconf
 import fnmatch
 import logging
 import weakref
+from types import MethodType
+import socket
+import atexit
+import json
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("rcute-cozmars")
@@ -26,6 +30,7 @@ def pkg(file_name):
 
 def bgr(color):
     if isinstance(color, str):
+        from PIL import ImageColor
         return ImageColor.getrgb(color)[::-1]
     else:
         return color
@@ -35,51 +40,228 @@ def freq(tone):
     # see https://github.com/gpiozero/gpiozero/blob/master/gpiozero/tones.py#L114
     # 0 is treated as None, not midi 8.1hz
     if isinstance(tone, str):
+        import librosa
         return librosa.note_to_hz(tone)
     elif isinstance(tone, int) and 0< tone<128:
+        import librosa
         return librosa.midi_to_hz(tone)
     else:
         return tone
 
-async def find_service(service, type, wait=2):
-    found = []
-    class ServiceListener:
-        def add_service(self, zeroconf, type, name):
-            info = zeroconf.get_service_info(type, name)
-            if fnmatch.fnmatch(name, f"{service}.{type}"):
-                found.append(info)
+class _ServiceBrowser:
+    # process-wide mDNS browser shared by all connections, resolved services are kept until zeroconf removes them
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zeroconf = None
+        self._browsers = {}
+        self._started = {}
+        self._found = {}
+        self._waiters = set()
+
+    def browse(self, type):
+        with self._lock:
+            if type not in self._browsers:
+                from zeroconf import ServiceBrowser, Zeroconf
+                if not self._zeroconf:
+                    # create it outside of the event loop, so that zeroconf runs in its own thread and outlives the loop
+                    t = threading.Thread(target=lambda: setattr(self, '_zeroconf', Zeroconf()))
+                    t.start()
+                    t.join()
+                    atexit.register(self._zeroconf.close)
+                self._found[type] = {}
+                self._started[type] = time.monotonic()
+                self._browsers[type] = ServiceBrowser(self._zeroconf, type, self)
+
+    def browsing_time(self, type):
+        # seconds since browsing of `type` started
+        with self._lock:
+            return time.monotonic() - self._started[type]
+
+    def services(self, service, type):
+        with self._lock:
+            return [info for name, info in self._found.get(type, {}).items() if fnmatch.fnmatch(name, f"{service}.{type}")]
+
+    def address(self, host):
+        host = host.rstrip('.') + '.'
+        with self._lock:
+            for found in self._found.values():
+                for info in found.values():
+                    if info.server == host and info.addresses:
+                        return socket.inet_ntoa(info.addresses[0])
+
+    def add_service(self, zeroconf, type, name):
+        info = zeroconf.get_service_info(type, name)
+        if info:
+            with self._lock:
+                self._found[type][name] = info
+                waiters = list(self._waiters)
+            for lo, ev in waiters:
+                try:
+                    lo.call_soon_threadsafe(ev.set)
+                except RuntimeError: # loop closed
+                    pass
+
+    update_service = add_service
+
+    def remove_service(self, zeroconf, type, name):
+        with self._lock:
+            self._found[type].pop(name, None)
+
+_browser = _ServiceBrowser()
+
+async def find_service(service, type, wait=2, count=None):
+    # return as soon as `count` services are found, or after `wait` seconds
+    lo = asyncio.get_running_loop()
+    # browsing may start zeroconf in a thread and wait for it
+    await lo.run_in_executor(None, _browser.browse, type)
+    waiter = lo, asyncio.Event()
+    deadline = lo.time() + wait
+    # the waiters are iterated in zeroconf's thread
+    with _browser._lock:
+        _browser._waiters.add(waiter)
     try:
-        zeroconf = Zeroconf()
-        browser = ServiceBrowser(zeroconf, type, ServiceListener())
-        await asyncio.sleep(wait)
-        return found
+        while True:
+            waiter[1].clear()
+            found = _browser.services(service, type)
+            if count and len(found) >= count or lo.time() >= deadline:
+                return found
+            try:
+                await asyncio.wait_for(waiter[1].wait(), deadline - lo.time())
+            except asyncio.TimeoutError:
+                pass
     finally:
-        zeroconf.close()
+        with _browser._lock:
+            _browser._waiters.discard(waiter)
+
+async def find_device(service, name, settle=.3):
+    # host name of the only device of `service` (e.g. 'rcute-cozmars-????') on the network
+    # returns once a device is found and the browser has run for `settle` seconds, in which other devices usually answer too,
+    # so that several devices are reported instead of picking one at random
+    type = '_ws._tcp.local.'
+    found = await find_service(service, type, count=1)
+    wait = settle - _browser.browsing_time(type)
+    if found and wait > 0:
+        await asyncio.sleep(wait)
+        found = _browser.services(service, type)
+    if not found:
+        raise ConnectionError(f'No {name} found')
+    if len(found) > 1:
+        serials = sorted(a.server.rstrip('.').split('-')[-1].split('.')[0] for a in found)
+        raise ConnectionError(f'More than one {name} found {serials}, please specify the serial number or IP address to connect to')
+    return found[0].server.rstrip('.')
+
+host_cache_file = None
+"""Path of a json file to cache IP addresses of connected devices, so that reconnecting to a device by its serial number can skip mDNS. Default to `None`, which disables the cache."""
+
+def _load_host_cache():
+    try:
+        with open(path.expanduser(host_cache_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def cached_address(host):
+    # IP address of `host` found by mDNS or saved in host cache, `host` itself if unknown
+    addr = _browser.address(host)
+    if not addr and host_cache_file:
+        addr = _load_host_cache().get(host.rstrip('.'))
+    return addr or host
+
+def cache_address(host, addr):
+    if host_cache_file and host.rstrip('.') != addr:
+        cache = _load_host_cache()
+        if addr is None:
+            cache.pop(host.rstrip('.'), None)
+        else:
+            cache[host.rstrip('.')] = addr
+        with open(path.expanduser(host_cache_file), 'w') as f:
+            json.dump(cache, f)
+
+async def ws_connect(host, url, timeout=3, **kw):
+    # connect to cached IP address first, and fall back to `host` if the address is stale
+    # `kw` are passed to `websockets.connect`, e.g. ping_interval and ping_timeout
+    import websockets
+    addr = cached_address(host)
+    if addr != host:
+        try:
+            return addr, await asyncio.wait_for(websockets.connect(url.format(addr), **kw), timeout)
+        except Exception as e:
+            logger.info(f'Cannot connect to {host} at cached address {addr}: {e!r}')
+            cache_address(host, None)
+    return host, await websockets.connect(url.format(host), **kw)
+
+def http_session(timeout, limit):
+    # one pooled keep-alive session per device, instead of a new connection for each request
+    import aiohttp
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout), connector=aiohttp.TCPConnector(limit=limit))
+
+async def http_get(session, url):
+    async with session.get(url) as resp:
+        return await resp.text()
 
 def sample_width(dtype):
     return {'int16':2, 'float32':4, 'float64':8, 'int8':1, 'int32':4}[dtype]
 
+_background = set()
+
+def _log_exception(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error('Error in background command', exc_info=task.exception())
+
+def _spawn(coro):
+    # fire-and-forget, keep a reference until the task is done
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_log_exception)
+    return task
+
+def _call(lo, coro, timeout):
+    # lighter than run_coroutine_threadsafe + concurrent.futures.Future: one lock, no future chaining
+    done = threading.Lock()
+    done.acquire()
+    tasks = []
+    def on_done(task):
+        tasks.append(task)
+        done.release()
+    lo.call_soon_threadsafe(lambda: lo.create_task(coro).add_done_callback(on_done))
+    if not done.acquire(timeout=-1 if timeout is None else timeout):
+        return None
+    return tasks[0].result()
+
 def mode(force_sync=True, property_type=None):
+    """Decorate coroutine methods of a component to support all the three connection modes.
+
+    When called outside of the event loop, two extra keyword arguments are accepted:
+
+    * timeout - seconds to wait for the result in sync mode, `None` is returned on timeout
+    * nowait - if `True`, don't wait for the command to finish and return `None` immediately (fire-and-forget), errors are logged
+    """
     def func_deco(func):
+        if not asyncio.iscoroutinefunction(func):
+            raise ImportError('Cannot decorate connection.mode on non-coroutine function')
+        blocking = force_sync or property_type
 
         @functools.wraps(func)
-        def new_func(*args, **kwargs):
-            if not asyncio.iscoroutinefunction(func):
-                raise ImportError('Cannot decorate connection.mode on non-coroutine function')
+        def new_func(self, *args, **kwargs):
+            batch = _batch.get()
+            if batch is not None and batch._owner is _batch_owner():
+                if property_type and self._in_event_loop():
+                    return functools.partial(batch._add, self, func, self)
+                return batch._add(self, func, self, *args, **kwargs)
 
-            self = args[0]
             if self._in_event_loop():
-                return functools.partial(func, self) if property_type else func(*args, **kwargs)
-
-            fut = asyncio.run_coroutine_threadsafe(func(*args, **kwargs), self._lo)
-
-            if force_sync or property_type or self._mode == 'sync':
-                try:
-                    return fut.result(kwargs.pop('timeout', None))
-                except futures.TimeoutError:
-                    return None
+                if property_type:
+                    return MethodType(func, self)
+                return _spawn(func(self, *args, **kwargs)) if kwargs.pop('nowait', False) else func(self, *args, **kwargs)
+
+            timeout = kwargs.pop('timeout', None)
+            if kwargs.pop('nowait', False):
+                self._lo.call_soon_threadsafe(_spawn, func(self, *args, **kwargs))
+            elif blocking or self._mode == 'sync':
+                return _call(self._lo, func(self, *args, **kwargs), timeout)
             else: # mode == 'async'
-                return fut
+                return asyncio.run_coroutine_threadsafe(func(self, *args, **kwargs), self._lo)
 
         if property_type == 'getter':
             return property(new_func)
@@ -90,6 +272,85 @@ def mode(force_sync=True, property_type=None):
 
     return func_deco
 
+_batch = contextvars.ContextVar('rcute_cozmars_batch', default=None)
+
+def _batch_owner():
+    # tasks created inside a batch inherit the context variable, but only the task (or thread) that opened the batch adds to it
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return threading.current_thread()
+
+class Batch:
+    """Commands issued inside a batch are not sent one by one, but collected and sent concurrently when the batch exits,
+    so that they cost one round trip instead of one for each command.
+
+    Use ``with robot.batch():`` for :class:`Robot`/:class:`AsyncRobot`, and ``async with robot.batch():`` for :class:`AioRobot`.
+
+    Inside the batch, commands (including property getters and setters) return futures which are resolved when the batch exits,
+    so don't wait for them inside the batch. The results are also available in :data:`results` in the order they were issued.
+    If any command fails, its exception is raised when the batch exits.
+    Only commands issued by the task (or thread) that opened the batch are collected, commands of tasks created inside the batch run as usual.
+    """
+    def __init__(self, robot):
+        self._robot = weakref.proxy(robot)
+        self._calls = []
+        self._owner = None
+        self.results = None
+        """Results of the commands after the batch exits"""
+
+    def _add(self, obj, func, *args, **kwargs):
+        if obj._lo is not self._lo:
+            raise RuntimeError('Cannot batch commands of devices running in different event loops')
+        kwargs.pop('timeout', None)
+        kwargs.pop('nowait', None)
+        fut = self._lo.create_future() if obj._in_event_loop() else futures.Future()
+        self._calls.append((func(*args, **kwargs), fut))
+        return fut
+
+    def _start(self):
+        self._lo = self._robot._lo
+        self._owner = _batch_owner()
+        self._token = _batch.set(self)
+        return self
+
+    def _stop(self, exc):
+        _batch.reset(self._token)
+        self._owner = None
+        if exc:
+            for coro, fut in self._calls:
+                coro.close()
+                fut.cancel()
+            self._calls = []
+        return not exc
+
+    async def _flush(self):
+        calls, self._calls = self._calls, []
+        self.results = await asyncio.gather(*(coro for coro, _ in calls), return_exceptions=True)
+        for (_, fut), r in zip(calls, self.results):
+            if isinstance(r, BaseException):
+                fut.set_exception(r)
+                isinstance(fut, asyncio.Future) and fut.exception() # mark as retrieved, it's raised below anyway
+            else:
+                fut.set_result(r)
+        for r in self.results:
+            if isinstance(r, BaseException):
+                raise r
+
+    def __enter__(self):
+        if self._robot._in_event_loop():
+            raise AttributeError('__enter__')
+        return self._start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop(exc) and asyncio.run_coroutine_threadsafe(self._flush(), self._lo).result()
+
+    async def __aenter__(self):
+        return self._start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stop(exc) and (await self._flush())
+
 class withmixin:
     async def __aenter__(self):
         await self.open()
@@ -230,21 +491,23 @@ class MultiplexOutputStream:
 
 
 class MultiplexOutputStreamComponent(StreamComponent):
+    _output_stream = OutputStream
+
     def __init__(self, robot, q_size, multiplex_output_stream):
         StreamComponent.__init__(self, robot)
         self._q_size = q_size
         self._multiplex_output_stream = multiplex_output_stream
 
-    async def _async_get_buffer(self):
-        return OutputStream(self._multiplex_output_stream, maxsize=self._q_size)
+    async def _async_get_buffer(self, **options):
+        return self._output_stream(self._multiplex_output_stream, maxsize=self._q_size, **options)
 
-    def get_buffer(self):
+    def get_buffer(self, **options):
         """Get output data stream
         """
         if self._in_event_loop():
-            return OutputStream(self._multiplex_output_stream, maxsize=self._q_size)
+            return self._output_stream(self._multiplex_output_stream, maxsize=self._q_size, **options)
         else:
-            return asyncio.run_coroutine_threadsafe(self._async_get_buffer(), self._lo).result()
+            return asyncio.run_coroutine_threadsafe(self._async_get_buffer(**options), self._lo).result()
 
     @mode()
     async def close(self):